@@ -22,7 +22,6 @@ The NCL graphics and description for this script are found here: https://www.ncl
 import numpy as np
 import xarray as xr
 import cartopy.crs as ccrs
-import cartopy.util as cutil
 from cartopy.mpl.ticker import LongitudeFormatter, LatitudeFormatter
 
 import matplotlib.pyplot as plt
@@ -31,29 +30,28 @@ import matplotlib.ticker as tic
 import geocat.viz as gviz
 import geocat.datafiles as gdf
 
-###############################################################################
-# A utility function
-
-# Define a utility function that handles the no-shown-data artifact of 0 and 360-degree longitudes
-def xr_add_cyclic(da, coord):
-    cyclic_data, cyclic_coord = cutil.add_cyclic_point(da.values, coord=da[coord])
-
-    coords = da.coords.to_dataset()
-    coords[coord] = cyclic_coord
-    return xr.DataArray(cyclic_data, dims=da.dims, coords=coords.coords)
+from gallery_tools.cyclic import add_cyclic
 
 ###############################################################################
-# Open a netCDF data file using xarray default engine and load the data into xarrays
-ds = xr.open_dataset(gdf.get("netcdf_files/b003_TS_200-299.nc"), decode_times=False)
+# Open a netCDF data file using xarray default engine, in chunks of 12 time steps.
+# The data are only read when they are computed, one chunk at a time, so the
+# 100-year time series is never in memory at once
+ds = xr.open_dataset(gdf.get("netcdf_files/b003_TS_200-299.nc"), decode_times=False,
+                     chunks={"time": 12})
 x = ds.TS
 
 # Apply mean reduction from coordinates as performed in NCL's dim_rmvmean_n_Wrap(x,0)
-# Apply this only to x.isel(time=0) because NCL plot plots only for time=0
+# Apply this only to x.isel(time=0) because NCL plot plots only for time=0.
+# The time mean is accumulated over the chunks, and only the first time step is
+# read again for the anomaly
 newx = x.mean('time')
-newx = x.isel(time=0) - newx
+newx = (x.isel(time=0) - newx).compute()
 
-# Resolve the no-shown-data artifact of 0 and 360-degree longitudes
-newx = xr_add_cyclic(newx, "lon")
+# Resolve the no-shown-data artifact of 0 and 360-degree longitudes.
+# add_cyclic repeats the first longitude after the last one as a lazy view of
+# the field, keeping its attributes and encoding, where
+# add_cyclic_point(da.values, ...) copies the field into a wider array
+newx = add_cyclic(newx, "lon")
 
 ###############################################################################
 # Plot
@@ -1,8 +1,9 @@
 """
 mask_1.py
 ===============
-Demonstrates the use of the xarray's where function and 
-a masking array to mask out land or ocean.
+Demonstrates the use of a masking array (the ``ORO`` land/ocean codes)
+to mask out land or ocean, splitting the field into its land and ocean
+parts in one pass.
 
 - Original NCL script: https://www.ncl.ucar.edu/Applications/Scripts/mask_1.ncl
 - https://www.ncl.ucar.edu/Applications/Images/mask_1_1_lg.png
@@ -19,6 +20,8 @@ import xarray as xr
 import geocat.datafiles
 from geocat.viz.util import nclize_axis, add_lat_lon_ticklabels, truncate_colormap
 
+from gallery_tools.masking import split_categories
+
 ###############################################################################
 # Read in the netCDF file
 # =======================
@@ -37,32 +40,15 @@ ds = (
 # =============
 
 
-def xr_add_cyclic(da, coord):
-    """
-    Function to add a cyclic point to an array and a 
-    corresponding coordinate.
-    """
-    from cartopy.util import add_cyclic_point
-
-    cyclic_data, cyclic_coord = add_cyclic_point(da.values, coord=da[coord])
-
-    coords = da.coords.to_dataset()
-    coords[coord] = cyclic_coord
-    return xr.DataArray(
-        cyclic_data,
-        dims=da.dims,
-        coords=coords.coords,
-        attrs=da.attrs,
-        encoding=da.encoding,
-    )
-
-
-# Use xarray's where function to mask out land and then ocean data
+# Mask out land and then ocean data (ORO is 1 over land and 0 over the ocean).
+# This is equivalent to ``ds.TS.where(ds.ORO == 1.0)`` and
+# ``ds.TS.where(ds.ORO == 0.0)``, followed by adding a cyclic point to each,
+# but split_categories reads the field once for both categories and adds
+# the cyclic point as a lazy view instead of copying each masked field again.
 
-land_only = ds.TS.where(ds.ORO == 1.0)
-ocean_only = ds.TS.where(ds.ORO == 0.0)
-land_only = xr_add_cyclic(land_only, "lon")
-ocean_only = xr_add_cyclic(ocean_only, "lon")
+split = split_categories(ds.TS, ds.ORO, {"land": 1.0, "ocean": 0.0}, cyclic="lon")
+land_only = split["land"]
+ocean_only = split["ocean"]
 
 
 ###############################################################################
@@ -26,7 +26,12 @@ a. You can "cover" (i.e., "over lay") geographical features on
 
 b. You can "clip" a plot object with a geographical boundary.
 
-This example demonstrates approach (a).
+This example masks the data first, with the fraction of each grid cell
+covered by China and Taiwan (``gallery_tools.masking.region_coverage``).
+Every cell the countries touch has a nonzero coverage, so the masked
+contours reach the border instead of stopping short of it with blocky
+edges, and they are then clipped to the border itself (approach (b)).
+No cover layer has to be drawn over the other countries.
 
 This script is based on the NCL script http://www.ncl.ucar.edu/Applications/Scripts/overlay_11.ncl originally written by
 Yang Zhao (CAMS) (Chinese Academy of Meteorological Sciences).
@@ -37,7 +42,6 @@ The NCL graphics and description for this script are found here: https://www.ncl
 ###############################################################################
 # Basic Imports
 
-import xarray as xr
 import numpy as np
 import geocat.viz as gcv
 import cmaps
@@ -48,6 +52,7 @@ from matplotlib import pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.ticker import AutoMinorLocator
 from matplotlib.patches import PathPatch
+from matplotlib.path import Path
 
 from cartopy.feature import ShapelyFeature, OCEAN, LAKES, LAND
 from cartopy.crs import PlateCarree
@@ -55,13 +60,18 @@ from cartopy.mpl.patch import geos_to_path
 from cartopy.io.shapereader import Reader as ShapeReader, natural_earth
 from cartopy.mpl.ticker import LongitudeFormatter, LatitudeFormatter
 
+from gallery_tools.data import open_subset
+from gallery_tools.masking import region_coverage
+
 ###############################################################################
 # Read U,V,T from the data at 500hPa
 #
 # Here, we read the sample dataset with Xarray and select the ``time=0`` slice
-# and the ``lev=500`` hPa level.
+# and the ``lev=500`` hPa level.  ``open_subset`` applies the selection before
+# reading the file, so only that level is read from disk.
 
-ds = xr.open_dataset('../../data/netcdf_files/uvt.nc').sel(time=0, lev=500)
+ds = open_subset('../../data/netcdf_files/uvt.nc', variables=['U', 'V', 'T'],
+                 sel=dict(time=0, lev=500))
 
 # For convenience only, extract the U,V,T and lat and lon variables
 U = ds["U"]
@@ -97,34 +107,27 @@ crs = PlateCarree()
 # Using Cartopy's interface to the Natural Earth Collection of shapefiles
 # and geographical shape data, we construct the geographical boundaries
 # that we are interested in displaying, namely the country borders of China
-# and Taiwan, the borders of Chinese provinces, and all land borders *without*
-# China or Taiwan.
+# and Taiwan and the borders of Chinese provinces.
+
+# The map extent (lon_min, lon_max, lat_min, lat_max)
+extent = [100, 145, 15, 55]
 
 # Download the Natural Earth shapefile for country boundaries at 10m resolution
 shapefile = natural_earth(category='cultural',
                           resolution='10m',
                           name='admin_0_countries')
 
-# Sort the geometries in the shapefile into Chinese/Taiwanese or other
-country_geos = []
-other_land_geos = []
-for record in ShapeReader(shapefile).records():
-    if record.attributes['ADMIN'] in ['China', 'Taiwan']:
-        country_geos.append(record.geometry)
-    else:
-        other_land_geos.append(record.geometry)
-
-# Define a Cartopy Feature for the country borders and the land mask (i.e.,
-# all other land) from the shapefile geometries, so they can be easily plotted
+# Extract the Chinese and Taiwanese borders
+country_geos = [record.geometry for record in ShapeReader(shapefile).records()
+                if record.attributes['ADMIN'] in ['China', 'Taiwan']]
+
+# Define a Cartopy Feature for the country borders from the shapefile
+# geometries, so they can be easily plotted
 countries = ShapelyFeature(country_geos,
                            crs=crs,
                            facecolor='none',
                            edgecolor='black',
                            lw=1.5)
-land_mask = ShapelyFeature(other_land_geos,
-                           crs=crs,
-                           facecolor='white',
-                           edgecolor='none')
 
 # Download the Natural Earth shapefile for the states/provinces at 10m resolution
 shapefile = natural_earth(category='cultural',
@@ -142,6 +145,18 @@ provinces = ShapelyFeature(province_geos,
                            edgecolor='black',
                            lw=0.25)
 
+###############################################################################
+# Mask the temperature with the coverage of the grid cells
+#
+# ``region_coverage`` computes the fraction of the area of each grid cell
+# within China and Taiwan (and caches it for this grid).  Keeping the cells
+# with a nonzero coverage keeps every cell the border crosses, so the masked
+# field extends just past the border, where a mask of the grid points inside
+# the border would stop short of it.
+
+coverage = region_coverage(country_geos, lon, lat)
+T_region = T.where(coverage > 0)
+
 ###############################################################################
 # Plot
 
@@ -156,21 +171,25 @@ ax.xaxis.set_minor_locator(AutoMinorLocator(n=4))
 ax.yaxis.set_minor_locator(AutoMinorLocator(n=5))
 ax.tick_params("both", length=10, width=1.0, which="major", bottom=True, left=True, labelsize=20)
 ax.tick_params("both", length=7, width=0.5, which="minor", bottom=True, left=True, labelsize=20)
-ax.set_extent([100, 145, 15, 55], crs=crs)
+ax.set_extent(extent, crs=crs)
 ax.set_xticks([100, 120, 140])
 ax.set_yticks([20, 30, 40, 50])
 
-# Draw the temperature contour plot with the subselected colormap
+# Draw the masked temperature contour plot with the subselected colormap
 # (Place the zorder of the contour plot at the lowest level)
-cf = ax.contourf(lon, lat, T, levels=clevs, cmap=cmap, zorder=1)
+cf = ax.contourf(lon, lat, T_region, levels=clevs, cmap=cmap, zorder=1)
+
+# Clip the contour plot to the country borders, with one compound path for
+# all the islands; the masked field already ends within a grid cell of the
+# border, so the clipping only trims the edge cells
+patch = PathPatch(Path.make_compound_path(*geos_to_path(country_geos)),
+                  transform=ax.transData, facecolor='none', edgecolor='none')
+cf.set_clip_path(patch)
 
 # Draw the color bar for the contour plot
 cax = plt.axes((0.14, 0.08, 0.74, 0.02))
 fig.colorbar(cf, ax=ax, cax=cax, ticks=clevs[1:-1], drawedges=True, orientation='horizontal')
 
-# Add the land mask feature on top of the contour plot (higher zorder)
-ax.add_feature(land_mask, zorder=2)
-
 # Add the OCEAN and LAKES features on top of the contour plot
 ax.add_feature(OCEAN.with_scale('50m'), edgecolor='black', lw=1, zorder=2)
 ax.add_feature(LAKES.with_scale('50m'), edgecolor='black', lw=1, zorder=2)
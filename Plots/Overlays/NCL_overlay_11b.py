@@ -48,6 +48,7 @@ from matplotlib import pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.ticker import AutoMinorLocator
 from matplotlib.patches import PathPatch
+from matplotlib.path import Path
 
 from cartopy.feature import ShapelyFeature, OCEAN, LAKES, LAND
 from cartopy.crs import PlateCarree
@@ -168,31 +169,22 @@ ax.add_feature(LAKES.with_scale('50m'), edgecolor='black', lw=1)
 # (NOTE: There are multiple closed polygons representing the boundaries of the
 #        countries.  This is both because there are 2 country borders being used
 #        to clip the contour plot, but also because China consists of many islands.
-#        As a result, we have to loop over *all closed paths* and construct a
-#        matplotlib patch object that we can use the clip the contour plot.)
-for path in geos_to_path(country_geos):
-    patch = PathPatch(path, transform=ax.transData, facecolor='none', edgecolor='black', lw=1.5)
-
-    # Draw the patch on the plot
-    ax.add_patch(patch)
-
-    # Draw the contour plot
-    # (NOTE: Because this line is in the loop over closed paths, the contour plot
-    #        is being drawn for each closed path.  This has to be done because
-    #        matplotlib cannot apply *multiple* closed paths at the same time to
-    #        to the same plot.  Hence, for each closed path, we need to generate
-    #        another contour plot and clip that contour plot with the patch.  In
-    #        other words, every island on this plot corresponds to its own
-    #        contour plot!)
-    cf = ax.contourf(lon, lat, T, levels=clevs[1:-1], cmap=cmap)
-
-    # Clip each contour of the contour plot
-    # (NOTE: Each contour of the contour plot is actually its own "plot".  There
-    #        is no easy mechanism in matplotlib to clip the entire contour plot
-    #        at once, so we must loop through the "collections" in the contour
-    #        plot and clip each one separately.)
-    for col in cf.collections:
-        col.set_clip_path(patch)
+#        As a result, we join *all closed paths* into one compound path, and
+#        construct a single matplotlib patch object that we can use to clip the
+#        contour plot.)
+path = Path.make_compound_path(*geos_to_path(country_geos))
+patch = PathPatch(path, transform=ax.transData, facecolor='none', edgecolor='black', lw=1.5)
+
+# Draw the patch on the plot
+ax.add_patch(patch)
+
+# Draw the contour plot
+# (NOTE: Because the compound path holds every island at once, the contour plot
+#        is computed only once, however many islands there are.)
+cf = ax.contourf(lon, lat, T, levels=clevs[1:-1], cmap=cmap)
+
+# Clip the whole contour plot at once with the compound patch
+cf.set_clip_path(patch)
 
 # Add the contour plot colorbar
 cax = plt.axes((0.14, 0.08, 0.74, 0.02))
@@ -14,23 +14,26 @@ The NCL graphics and description for this script are found here: https://www.ncl
 
 ###############################################################################
 # Import necessary packages
-import xarray as xr
 from matplotlib import pyplot as plt
 import cartopy
 import cartopy.crs as ccrs
 from geocat.viz import cmaps
 from geocat.viz.util import add_lat_lon_ticklabels, nclize_axis, truncate_colormap
 
+from gallery_tools.data import open_subset
+
 ###############################################################################
 # Read in data from netCDF file.
 # Note that when we extract ``U``, ``V``, and ``T``,
 # we only read a subset of latitude and longitude.
 # This choice was made because ``geocat.viz`` doesn’t offer
 # an equivalent function to ncl’s ``vcMinDistanceF`` yet.
+# ``open_subset`` applies the selection before reading the file, so only
+# that subset is read from disk.
 
-file_in = xr.open_dataset('../../data/netcdf_files/83.nc')
-# Our dataset is a subset of the data from the file
-ds = file_in.isel(time=0, lev=12, lon=slice(0,-1,5), lat=slice(2,-1,3))
+ds = open_subset('../../data/netcdf_files/83.nc', variables=['U', 'V', 'T'],
+                 isel=dict(time=0, lev=12, lon=slice(0, -1, 5),
+                           lat=slice(2, -1, 3)))
 
 ###############################################################################
 # Make the plot.
@@ -25,6 +25,9 @@ import pandas as pd
 from matplotlib import pyplot as plt
 import matplotlib.ticker as tic
 
+from gallery_tools.climatology import anomaly_series
+from gallery_tools.stats import ensemble_stats, weighted_spatial_mean
+
 ###############################################################################
 # Open files and read in monthly data
 #
@@ -92,11 +95,8 @@ vds = xr.open_mfdataset(vfiles, concat_dim='case', combine='nested',
                         preprocess=assume_noleap_calendar, decode_times=False)
 
 # Read the "weights" file
-# (The xarray.Dataset.expand_dims call adds the longitude dimension to the
-# dataset, which originally depends only upon the latitude dimension. This
-# arguably makes computing the weighted means below more straight-forward.)
+# (The weights depend only upon the latitude dimension.)
 gds = xr.open_dataset("../../data/netcdf_files/gw.nc")
-gds = gds.expand_dims(dim={'lon': nds.lon})
 
 ###############################################################################
 # OBSERVATIONS
@@ -107,7 +107,8 @@ gds = gds.expand_dims(dim={'lon': nds.lon})
 # ``DataArray`` explicitly, since the time values are not stored in the
 # ASCII data file (we have to know them!).
 
-obs_data = np.loadtxt("../../data/ascii_files/jones_glob_ann_2002.asc", dtype=float)
+obs_file = "../../data/ascii_files/jones_glob_ann_2002.asc"
+obs_data = np.loadtxt(obs_file, dtype=float)
 obs_time = xr.cftime_range('1856-07-16T22:00:00', freq='365D',
                            periods=len(obs_data), calendar='noleap')
 obs = xr.DataArray(name='TREFHT', data=obs_data, coords=[('time', obs_time)])
@@ -116,10 +117,15 @@ obs = xr.DataArray(name='TREFHT', data=obs_data, coords=[('time', obs_time)])
 # NCL-based Weighted Mean Function
 #
 # We define this function just for convenience.  This is equivalent to how
-# NCL computes the weighted mean.
+# NCL computes the weighted mean.  Since the weights depend only upon
+# latitude, ``weighted_spatial_mean`` sums over longitude and then applies the
+# weights to the (much smaller) zonal sums, rather than broadcasting the
+# weights to the full latitude/longitude grid.  It reads the ensemble a block
+# of fields at a time, in a pool of threads, so its memory use does not grow
+# with the number of members or time steps.
 
 def horizontal_weighted_mean(var, wgts):
-    return (var * wgts).sum(dim=['lat', 'lon']) / wgts.sum(dim=['lat', 'lon'])
+    return weighted_spatial_mean(var, wgts, lat='lat', lon='lon')
 
 ###############################################################################
 # NATURAL DATA
@@ -127,9 +133,14 @@ def horizontal_weighted_mean(var, wgts):
 # We compute the weighted mean across the latitude and longitude dimensions
 # (leaving only the ``case`` and ``time`` dimensions), and then we compute the
 # anomaly measured from the average of the first 30 years.
+#
+# ``anomaly_series`` caches that average on disk, keyed by the files the
+# series is derived from and a name for how it is derived from them, so it is
+# computed again only when one of the files changes.
 
 gavn = horizontal_weighted_mean(nds["TREFHT"], gds["gw"])
-gavan = gavn - gavn.sel(time=slice('1890','1920')).mean(dim='time')
+gavan = anomaly_series(gavn, ('1890', '1920'), 'global mean',
+                       sources=nfiles + ["../../data/netcdf_files/gw.nc"])
 
 ###############################################################################
 # NATURAL + ANTHROPOGENIC DATA
@@ -137,14 +148,16 @@ gavan = gavn - gavn.sel(time=slice('1890','1920')).mean(dim='time')
 # We do the same thing for the "natural + anthropogenic" data.
 
 gavv = horizontal_weighted_mean(vds["TREFHT"], gds["gw"])
-gavav = gavv - gavv.sel(time=slice('1890','1920')).mean(dim='time')
+gavav = anomaly_series(gavv, ('1890', '1920'), 'global mean',
+                       sources=vfiles + ["../../data/netcdf_files/gw.nc"])
 
 ###############################################################################
 # OBSERVATION DATA
 #
 # We do the same thing for the observation data.
 
-obs_avg = obs.sel(time=slice('1890','1999')) - obs.sel(time=slice('1890','1920')).mean(dim='time')
+obs_avg = anomaly_series(obs.sel(time=slice('1890','1999')), ('1890', '1920'),
+                         'observations', sources=[obs_file])
 
 ###############################################################################
 # Calculate the ensemble MIN & MAX & MEAN
@@ -152,14 +165,20 @@ obs_avg = obs.sel(time=slice('1890','1999')) - obs.sel(time=slice('1890','1920')
 # Here we find the ``min``, ``max``, and ``mean`` along the ``case`` (i.e.,
 # ensemble) dimension (leaving only the ``time`` dimension) for both of our
 # datasets.  We compute the equivalent anomaly for the observations data.
-
-gavan_min = gavan.min(dim='case')
-gavan_max = gavan.max(dim='case')
-gavan_avg = gavan.mean(dim='case')
-
-gavav_min = gavav.min(dim='case')
-gavav_max = gavav.max(dim='case')
-gavav_avg = gavav.mean(dim='case')
+#
+# ``ensemble_stats`` computes the three statistics together, in one
+# traversal of each ensemble, rather than with three separate ``min``,
+# ``max`` and ``mean`` reductions.
+
+gavan_stats = ensemble_stats(gavan, dim='case')
+gavan_min = gavan_stats['min']
+gavan_max = gavan_stats['max']
+gavan_avg = gavan_stats['mean']
+
+gavav_stats = ensemble_stats(gavav, dim='case')
+gavav_min = gavav_stats['min']
+gavav_max = gavav_stats['max']
+gavav_avg = gavav_stats['mean']
 
 ###############################################################################
 # Create the Plot
@@ -12,8 +12,8 @@
 #
 import os
 import warnings
-# import sys
-# sys.path.insert(0, os.path.abspath('.'))
+import sys
+sys.path.insert(0, os.path.abspath('.'))
 
 
 # -- Project information -----------------------------------------------------
@@ -29,6 +29,8 @@ author = 'GeoCAT'
 # extensions coming with Sphinx (named 'sphinx.ext.*') or your custom
 # ones.
 extensions = [
+    'gallery_tools.cache',  # must come before parallel and gen_gallery
+    'gallery_tools.parallel',  # must come before gen_gallery
     'sphinx_gallery.gen_gallery',
 ]
 
@@ -83,3 +85,17 @@ sphinx_gallery_conf = {
     'filename_pattern': '^((?!sgskip).)*$',
     'gallery_dirs': ['auto_examples'],  # path to where to save gallery generated output
 }
+
+# Number of worker processes used to execute the gallery examples
+# (1 runs them serially inside sphinx-gallery)
+gallery_jobs = int(os.environ.get('GALLERY_JOBS', 1))
+
+# Memory budget (MB) of the caches sharing the datasets opened by the examples
+# run in the same worker process, for all the workers together (each worker
+# gets an equal share)
+gallery_data_cache_mb = float(os.environ.get('GALLERY_DATA_CACHE_MB', 2048))
+
+# Cache of the gallery output, keyed by the content of each example script,
+# of the data files it reads and of the library versions (empty to disable)
+gallery_cache_dir = os.environ.get('GALLERY_CACHE_DIR',
+                                   os.path.join('_build', 'gallery_cache'))
@@ -0,0 +1,9 @@
+"""
+gallery_tools
+=============
+Build and execution helpers for the GeoCAT-examples gallery.
+
+These modules are not examples themselves; they are Sphinx extensions and
+command line tools used to build, render and benchmark the scripts under
+``Plots/``.
+"""
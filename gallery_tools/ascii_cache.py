@@ -0,0 +1,174 @@
+"""
+ascii_cache.py
+==============
+Read ASCII (text) tables of numbers once, and memory-map a binary copy on
+the next reads.
+
+``np.loadtxt`` parses a text file line by line in Python on every run.
+``load`` parses it once with pandas' C parser and saves the array as a
+``.npy`` file, which later calls map into memory without parsing or copying
+(copy-on-write: modifying the array does not modify the cache).  Each copy
+has a ``.json`` sidecar with the size, modification time and content hash of
+its text file, and is rewritten when the text file changes.
+
+``load_series`` also builds (once) and caches the time coordinate of a
+series whose times are not stored in the file, such as the annual
+observations read by ``NCL_xy_18.py``.
+
+``install`` routes plain ``np.loadtxt(fname, dtype=...)`` calls through
+``load``, which is how the batch renderer and the parallel gallery workers
+use it without changing the examples.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from gallery_tools.fingerprint import (atomic_write, keyed_path, source_info,
+                                       source_matches)
+from gallery_tools.runner import REPO_DIR
+
+# Directory of the binary copies (an empty string disables the cache)
+DEFAULT_CACHE_DIR = os.environ.get(
+    'GALLERY_ASCII_DIR', os.path.join(REPO_DIR, '_build', 'ascii_cache'))
+
+
+def cache_path(path, cache_dir=None):
+    """Return the path of the binary copy of a text file, without extension."""
+    return keyed_path(path, cache_dir or DEFAULT_CACHE_DIR)
+
+
+def parse(path, dtype=float):
+    """
+    Parse a whitespace-separated table of numbers (with ``#`` comments) like
+    ``np.loadtxt(path, dtype=dtype)``, with pandas' C parser.
+    """
+    import pandas as pd
+
+    try:
+        table = pd.read_csv(path, sep=r'\s+', header=None, comment='#',
+                            dtype=dtype, engine='c')
+    except (ValueError, pd.errors.ParserError, pd.errors.EmptyDataError):
+        # Let numpy parse (or report) anything unusual
+        return np.loadtxt(path, dtype=dtype)
+    return np.squeeze(table.to_numpy())
+
+
+def _save(fname, array):
+    with atomic_write(fname) as fid:
+        np.save(fid, array)
+
+
+def _save_info(fname, info):
+    with atomic_write(fname, 'w') as fid:
+        json.dump(info, fid, indent=1)
+
+
+def _cached_info(base, path):
+    """Return the sidecar of a binary copy if it matches its text file."""
+    if not os.path.exists(base + '.json'):
+        return None
+    with open(base + '.json') as fid:
+        info = json.load(fid)
+    mtime_ns = info['source']['mtime_ns']
+    if not source_matches(path, info['source']):
+        return None
+    if info['source']['mtime_ns'] != mtime_ns:
+        _save_info(base + '.json', info)
+    return info
+
+
+def load(path, dtype=float, cache_dir=None):
+    """
+    Read a text table of numbers like ``np.loadtxt(path, dtype=dtype)``,
+    from its binary copy if it is up to date.
+
+    Returns a copy-on-write ``np.memmap`` of the binary copy (or, with the
+    cache disabled, the parsed array).
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    if not cache_dir:
+        return parse(path, dtype)
+    base = cache_path(path, cache_dir)
+    dtype = np.dtype(dtype)
+    info = _cached_info(base, path)
+    if info is None or info['dtype'] != dtype.str:
+        os.makedirs(cache_dir, exist_ok=True)
+        _save(base + '.npy', np.ascontiguousarray(parse(path, dtype)))
+        info = {'source': source_info(path), 'dtype': dtype.str}
+        _save_info(base + '.json', info)
+    return np.load(base + '.npy', mmap_mode='c')
+
+
+def _time_coordinate(base, info, start, freq, periods, calendar):
+    """Build the ``cftime_range`` time coordinate of a series, or decode it
+    from its cached numeric values."""
+    import cftime
+    import xarray as xr
+
+    spec = {'start': start, 'freq': freq, 'periods': periods,
+            'calendar': calendar}
+    if info is not None and info.get('time') == spec and \
+            os.path.exists(base + '.time.npy'):
+        seconds = np.load(base + '.time.npy')
+        units = 'seconds since %s' % info['time_origin']
+        dates = cftime.num2date(seconds, units, calendar,
+                                only_use_cftime_datetimes=True)
+        return xr.CFTimeIndex(dates, name='time')
+
+    times = xr.cftime_range(start, periods=periods, freq=freq,
+                            calendar=calendar, name='time')
+    if info is not None:
+        origin = times[0].strftime('%Y-%m-%d %H:%M:%S')
+        seconds = cftime.date2num(list(times), 'seconds since %s' % origin,
+                                  calendar).astype(np.int64)
+        _save(base + '.time.npy', seconds)
+        info['time'] = spec
+        info['time_origin'] = origin
+        _save_info(base + '.json', info)
+    return times
+
+
+def load_series(path, start, freq, calendar='standard', name=None,
+                dtype=float, cache_dir=None):
+    """
+    Read a text file holding one value per time step as a ``DataArray``,
+    with the time coordinate ``xarray.cftime_range(start, freq=freq,
+    periods=len(values), calendar=calendar)``.
+
+    The values are memory-mapped from the binary copy of the file and the
+    time coordinate is decoded from a cached numeric copy, so neither is
+    rebuilt on later reads.
+    """
+    import xarray as xr
+
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    values = load(path, dtype, cache_dir)
+    base = cache_path(path, cache_dir) if cache_dir else None
+    info = _cached_info(base, path) if base else None
+    times = _time_coordinate(base, info, start, freq, len(values), calendar)
+    return xr.DataArray(values, coords=[('time', times)], name=name)
+
+
+def install(cache_dir=None):
+    """
+    Route ``np.loadtxt(fname)`` and ``np.loadtxt(fname, dtype)`` calls on a
+    file path through ``load``.  Other calls go straight to numpy.
+    """
+    if getattr(np.loadtxt, '_ascii_cache', False):
+        return
+    loadtxt = np.loadtxt
+
+    def cached_loadtxt(fname, dtype=float, *args, **kwargs):
+        if args or kwargs or not isinstance(fname, (str, os.PathLike)) or \
+                not os.path.isfile(fname):
+            return loadtxt(fname, dtype, *args, **kwargs)
+        return load(fname, dtype, cache_dir)
+
+    cached_loadtxt.__doc__ = loadtxt.__doc__
+    cached_loadtxt.__wrapped__ = loadtxt
+    cached_loadtxt._ascii_cache = True
+    np.loadtxt = cached_loadtxt
@@ -0,0 +1,320 @@
+"""
+bench.py
+========
+Benchmark the example scripts one by one.
+
+Each script runs in a fresh process (see ``gallery_tools.runner``), so its
+peak resident memory is its own.  The wall time of a run is split into
+stages by timing the library calls the examples are built from:
+
+========  ==============================================================
+import    module imports
+open      opening data (xarray/numpy readers, shapefiles, datafiles)
+compute   dask computations and any script time outside the other stages
+artists   Axes/GeoAxes plotting methods, colorbars, subplots
+draw      rendering and saving the figures
+========  ==============================================================
+
+A stage only counts the time not spent in a nested stage (e.g. the dask
+computation triggered inside ``ax.fill_between`` counts as ``compute``).
+
+Usage::
+
+    python -m gallery_tools.bench -o after.json
+    python -m gallery_tools.bench -o after.json --baseline before.json --threshold 1.2
+    python -m gallery_tools.bench 'Plots/XY/*.py' --repeat 3
+
+With ``--baseline``, examples whose wall time grew by more than
+``--threshold`` times are flagged and the command exits with status 1.
+"""
+
+import argparse
+import builtins
+import functools
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from gallery_tools.fingerprint import library_versions
+from gallery_tools.runner import REPO_DIR, find_scripts, run_script, warm_up
+
+STAGES = ('import', 'open', 'compute', 'artists', 'draw')
+
+
+class StageTimer(object):
+    """Accumulate exclusive wall time per stage from nested stage calls."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._stack = []
+        self._last = None
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            self.totals[self._stack[-1]] += now - self._last
+        self._stack.append(stage)
+        self._last = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.totals[self._stack.pop()] += now - self._last
+        self._last = now
+
+    def wrap(self, func, stage):
+        """Return ``func`` timed as ``stage``."""
+        if getattr(func, '_bench_stage', None):
+            return func
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                generator = func(*args, **kwargs)
+                while True:
+                    self.enter(stage)
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        self.exit()
+                    yield item
+        else:
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                self.enter(stage)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.exit()
+
+        timed._bench_stage = stage
+        return timed
+
+    def patch(self, owner, names, stage):
+        """Time the named functions of a module or class as ``stage``."""
+        for name in names:
+            func = getattr(owner, name, None)
+            if inspect.isfunction(func):
+                setattr(owner, name, self.wrap(func, stage))
+
+    def patch_methods(self, cls, stage):
+        """Time every public method defined by ``cls`` as ``stage``."""
+        self.patch(cls, [name for name in vars(cls)
+                         if not name.startswith('_')], stage)
+
+
+def _instrument(timer):
+    """Time imports, and install the stage timers on the libraries used by
+    the examples as soon as the script imports them."""
+    def geoaxes(module):
+        timer.patch_methods(module.GeoAxes, 'artists')
+
+    def shapereader(module):
+        timer.patch(module, ['natural_earth'], 'open')
+        timer.patch(module.BasicReader,
+                    ['__init__', 'records', 'geometries'], 'open')
+
+    def figure(module):
+        timer.patch(module.Figure, ['add_axes', 'add_subplot', 'subplots',
+                                    'colorbar', 'suptitle', 'legend', 'text'],
+                    'artists')
+        timer.patch(module.Figure, ['savefig'], 'draw')
+
+    patches = {
+        'numpy': lambda module: timer.patch(
+            module, ['loadtxt', 'genfromtxt', 'load', 'fromfile'], 'open'),
+        'xarray': lambda module: timer.patch(
+            module, ['open_dataset', 'open_dataarray', 'open_mfdataset',
+                     'open_zarr', 'load_dataset'], 'open'),
+        'geocat.datafiles': lambda module: timer.patch(module, ['get'],
+                                                       'open'),
+        'cartopy.io.shapereader': shapereader,
+        'matplotlib.axes': lambda module: timer.patch_methods(module.Axes,
+                                                              'artists'),
+        'cartopy.mpl.geoaxes': geoaxes,
+        'matplotlib.figure': figure,
+        'matplotlib.backends.backend_agg': lambda module: timer.patch(
+            module.FigureCanvasAgg, ['draw', 'print_png'], 'draw'),
+        'dask.threaded': lambda module: timer.patch(module, ['get'],
+                                                    'compute'),
+    }
+    timed_import = timer.wrap(builtins.__import__, 'import')
+
+    def instrumented_import(*args, **kwargs):
+        module = timed_import(*args, **kwargs)
+        for name in list(patches):
+            imported = sys.modules.get(name)
+            # Wait until the module is fully initialized
+            if imported is not None and \
+                    not getattr(imported.__spec__, '_initializing', False):
+                patches.pop(name)(imported)
+        return module
+
+    builtins.__import__ = instrumented_import
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def _save_figures(figures):
+    for figure in figures:
+        figure.savefig(io.BytesIO(), format='png')
+
+
+def bench_script(path, warm=False):
+    """Run one script and return its timings (meant to run in a fresh
+    process).  With ``warm``, the process is warmed up (see
+    ``gallery_tools.runner.warm_up``) before the clock starts, as in the
+    long-lived workers of the render and gallery builds."""
+    if warm:
+        warm_up()
+    timer = StageTimer()
+    t_start = time.perf_counter()
+    _instrument(timer)
+    error = None
+    try:
+        run_script(path, on_show=_save_figures)
+    except Exception:
+        error = traceback.format_exc()
+    wall = time.perf_counter() - t_start
+
+    stages = {stage: timer.totals.get(stage, 0.) for stage in STAGES}
+    stages['compute'] += wall - sum(timer.totals.values())
+    return {'wall': wall,
+            'stages': stages,
+            'peak_rss_mb': _peak_rss_mb(),
+            'status': 'ok' if error is None else 'error',
+            'error': error}
+
+
+def run_benchmarks(scripts, repeat=1, warm=False):
+    """
+    Benchmark scripts, each in its own spawned process.
+
+    Returns a ``{script: result}`` dict, keeping the fastest of ``repeat``
+    runs of each script.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for script in scripts:
+        name = os.path.relpath(script, REPO_DIR)
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1,
+                                     mp_context=context) as executor:
+                runs.append(executor.submit(bench_script, script,
+                                            warm).result())
+        results[name] = min(runs, key=lambda run: run['wall'])
+        print('%-45s %8.2f s' % (name, results[name]['wall']),
+              file=sys.stderr)
+    return results
+
+
+def _metadata():
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'versions': library_versions()}
+
+
+def compare(results, baseline, threshold):
+    """Return the examples whose wall time exceeds ``threshold`` times their
+    baseline wall time, as ``{example: ratio}``."""
+    slower = {}
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or result['status'] != 'ok' or \
+                base['status'] != 'ok':
+            continue
+        ratio = result['wall'] / base['wall']
+        if ratio > threshold:
+            slower[name] = ratio
+    return slower
+
+
+def format_table(results, baseline=None, threshold=None):
+    """Format the results (and their baseline comparison) as a text table."""
+    header = ['example', 'wall'] + list(STAGES) + ['rss MB']
+    if baseline is not None:
+        header += ['base', 'ratio', '']
+    slower = compare(results, baseline, threshold) if baseline else {}
+    rows = []
+    for name, result in sorted(results.items()):
+        if result['status'] != 'ok':
+            row = [name, 'error'] + [''] * (len(header) - 2)
+        else:
+            row = [name, '%.2f' % result['wall']]
+            row += ['%.2f' % result['stages'][stage] for stage in STAGES]
+            row += ['%.0f' % result['peak_rss_mb']]
+            if baseline is not None:
+                base = baseline.get(name)
+                if base is None or base['status'] != 'ok':
+                    row += ['-', '-', '']
+                else:
+                    row += ['%.2f' % base['wall'],
+                            '%.2f' % (result['wall'] / base['wall']),
+                            'SLOWER' if name in slower else '']
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows + [header])
+              for i in range(len(header))]
+    lines = ['  '.join(cell.ljust(width) if i == 0 else cell.rjust(width)
+                       for i, (cell, width) in enumerate(zip(row, widths)))
+             for row in [header] + rows]
+    lines.insert(1, '-' * len(lines[0]))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m gallery_tools.bench',
+        description='Benchmark the gallery example scripts.')
+    parser.add_argument('scripts', nargs='*',
+                        help='scripts or glob patterns (default: Plots/**/*.py)')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('-b', '--baseline',
+                        help='JSON results of an earlier run to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=1.2,
+                        help='flag examples slower than THRESHOLD times '
+                             'their baseline (default: 1.2)')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='run each script REPEAT times, keep the fastest')
+    parser.add_argument('-w', '--warm', action='store_true',
+                        help='warm up each process before timing the script')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(find_scripts(args.scripts), repeat=args.repeat,
+                             warm=args.warm)
+    if args.output:
+        with open(args.output, 'w') as fid:
+            json.dump({'metadata': _metadata(), 'examples': results}, fid,
+                      indent=1, sort_keys=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fid:
+            baseline = json.load(fid)['examples']
+    print(format_table(results, baseline, args.threshold))
+    if baseline is not None:
+        slower = compare(results, baseline, args.threshold)
+        if slower:
+            print('\n%d examples slower than %.2fx their baseline'
+                  % (len(slower), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""
+cache.py
+========
+A Sphinx extension that caches the gallery output of every example, keyed by
+the content of the script, of each data file the script reads and of the
+versions of the libraries it runs with.
+
+sphinx-gallery decides whether to re-run an example from the md5 of the
+script alone.  While an example executes, this extension records the files
+it opens (netCDF files opened through xarray, ASCII files, shapefiles, ...).
+When the build finishes, the images, rst, notebook and md5 files of every
+example that ran are copied to the cache together with those records.  On
+the next build, before sphinx-gallery (and ``gallery_tools.parallel``) look
+at the examples:
+
+- an example whose script, inputs and library versions all match its cache
+  entry gets its output restored, so it is not executed;
+- an example whose script is unchanged but whose inputs or library versions
+  changed is marked stale, so it is executed again;
+- an example whose output is current but has no cache entry (e.g. it was
+  built before the cache was enabled) is marked stale as well, so that its
+  inputs are recorded.
+
+The cache lives in the ``gallery_cache_dir`` configuration value (relative to
+the documentation source directory); an empty value disables it.  This
+extension must be listed before ``gallery_tools.parallel`` and
+``sphinx_gallery.gen_gallery`` in ``extensions``.
+"""
+
+import glob
+import json
+import os
+import shutil
+import sys
+
+import sphinx_gallery
+from sphinx.util import logging
+from sphinx_gallery.utils import get_md5sum
+
+from gallery_tools.examples import (collect_examples, complete_conf,
+                                    executing_example, is_current,
+                                    is_supported)
+from gallery_tools.fingerprint import (atomic_write, file_digest,
+                                       library_versions, load_digests,
+                                       save_digests)
+
+logger = logging.getLogger(__name__)
+
+# Paths of the input record of the example being executed in this process
+_record_file = None
+_record_paths = None
+# Directories whose files are never recorded (installed packages, caches)
+_ignored_dirs = ()
+
+
+###############################################################################
+# Input tracking (runs in the process executing the example)
+
+def _ignored_dirs_of(gallery_conf):
+    """Installed packages, matplotlib's caches, the copies of the data files
+    made by the gallery tools (their sources are recorded instead) and the
+    gallery output (read back by the image scrapers) are not inputs of an
+    example."""
+    from gallery_tools import (ascii_cache, climatology, contour, ensemble,
+                               features, geostore, masking, zarr_cache)
+
+    dirs = {sys.prefix, sys.base_prefix, sys.exec_prefix}
+    dirs.update(d for d in (zarr_cache.DEFAULT_STORE_DIR,
+                            ensemble.DEFAULT_CACHE_DIR,
+                            ascii_cache.DEFAULT_CACHE_DIR,
+                            geostore.DEFAULT_STORE_DIR,
+                            features.DEFAULT_CACHE_DIR,
+                            masking.DEFAULT_CACHE_DIR,
+                            contour.DEFAULT_CACHE_DIR,
+                            climatology.DEFAULT_CACHE_DIR) if d)
+    gallery_dirs = gallery_conf['gallery_dirs']
+    if not isinstance(gallery_dirs, list):
+        gallery_dirs = [gallery_dirs]
+    dirs.update(os.path.join(gallery_conf['src_dir'], gallery_dir)
+                for gallery_dir in gallery_dirs)
+    try:
+        import matplotlib
+        dirs.update((matplotlib.get_cachedir(), matplotlib.get_configdir()))
+    except ImportError:
+        pass
+    return tuple(os.path.join(os.path.realpath(d), '') for d in dirs)
+
+
+def _record(path):
+    """Add a file to the input record of the running example."""
+    if _record_paths is None:
+        return
+    try:
+        path = os.path.realpath(os.fspath(path))
+    except TypeError:
+        return
+    if path in _record_paths or not os.path.isfile(path):
+        return
+    if path.endswith(('.py', '.pyc', '.so')) or path.startswith(_ignored_dirs):
+        return
+    _record_paths.add(path)
+    with open(_record_file, 'w') as fid:
+        json.dump(sorted(_record_paths), fid, indent=1)
+
+
+def _record_paths_of(paths):
+    """Record a path, a glob pattern or a list of either."""
+    if isinstance(paths, (list, tuple)):
+        for path in paths:
+            _record_paths_of(path)
+    elif isinstance(paths, str) and glob.has_magic(paths):
+        for path in glob.glob(paths):
+            _record(path)
+    elif isinstance(paths, (str, bytes, os.PathLike)):
+        _record(paths)
+
+
+def _audit_open(event, args):
+    # Files read through Python's open() (np.loadtxt, pyshp, ...)
+    if event != 'open' or _record_paths is None:
+        return
+    path, mode, flags = args
+    if not isinstance(path, (str, bytes)):
+        return
+    if isinstance(mode, str):
+        if any(c in mode for c in 'wax+'):
+            return
+    elif flags & (os.O_WRONLY | os.O_RDWR | os.O_CREAT):
+        return
+    _record(path)
+
+
+def _wrap_opener(module, name):
+    opener = getattr(module, name)
+    if getattr(opener, '_gallery_tracked', False):
+        return
+
+    def tracked_opener(paths, *args, **kwargs):
+        _record_paths_of(paths)
+        return opener(paths, *args, **kwargs)
+
+    tracked_opener.__doc__ = opener.__doc__
+    tracked_opener.__wrapped__ = opener
+    tracked_opener._gallery_tracked = True
+    setattr(module, name, tracked_opener)
+
+
+_hooks_installed = False
+
+
+def _install_hooks():
+    global _hooks_installed
+    if _hooks_installed:
+        return
+    sys.addaudithook(_audit_open)
+    # netCDF files are opened by the netCDF C library, which bypasses the
+    # audit hook, so xarray's openers are wrapped as well.  So are numpy's
+    # text readers and cartopy's shapefile reader, whose files are not opened
+    # at all when their copies are read instead (see gallery_tools.ascii_cache
+    # and gallery_tools.geostore), and gallery_tools.data.open_subset, which
+    # may read a Zarr copy.
+    try:
+        import xarray
+    except ImportError:
+        pass
+    else:
+        for name in ('open_dataset', 'open_dataarray', 'open_mfdataset',
+                     'open_zarr'):
+            if hasattr(xarray, name):
+                _wrap_opener(xarray, name)
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        for name in ('loadtxt', 'genfromtxt'):
+            _wrap_opener(numpy, name)
+    try:
+        from cartopy.io import shapereader
+    except ImportError:
+        pass
+    else:
+        _wrap_opener(shapereader, 'Reader')
+    from gallery_tools import data
+    _wrap_opener(data, 'open_subset')
+    _hooks_installed = True
+
+
+def record_inputs(gallery_conf, fname):
+    """
+    sphinx-gallery module resetter that starts the input record of ``fname``.
+
+    It is called before each example is executed (in the Sphinx process or
+    in a ``gallery_tools.parallel`` worker).
+    """
+    global _record_file, _record_paths, _ignored_dirs
+    cache_dir = gallery_conf.get('gallery_cache_dir')
+    if not cache_dir:
+        return
+    _install_hooks()
+    _ignored_dirs = _ignored_dirs_of(gallery_conf)
+    src_file = executing_example(gallery_conf, fname)
+    _record_file = _record_path(cache_dir, os.path.relpath(
+        src_file, gallery_conf['src_dir']))
+    os.makedirs(os.path.dirname(_record_file), exist_ok=True)
+    _record_paths = set()
+    with open(_record_file, 'w') as fid:
+        json.dump([], fid)
+
+
+def _record_path(cache_dir, example):
+    """Return the input record of an example, by its path relative to the
+    documentation source directory (examples of different subsections may
+    have the same file name)."""
+    return os.path.join(cache_dir, 'records', example + '.json')
+
+
+def stop_recording(*args):
+    """Stop recording the files opened by the Sphinx process once the
+    examples have run."""
+    global _record_file, _record_paths
+    _record_file = _record_paths = None
+
+
+###############################################################################
+# Cache entries
+
+def _output_files(target_dir, fname):
+    """Return the gallery files generated for an example, relative to
+    ``target_dir``."""
+    base = os.path.splitext(fname)[0]
+    names = [fname, fname + '.md5', base + '.rst', base + '.ipynb',
+             base + '_codeobj.pickle']
+    files = [name for name in names
+             if os.path.exists(os.path.join(target_dir, name))]
+    patterns = [os.path.join('images', 'sphx_glr_%s_[0-9][0-9][0-9].*' % base),
+                os.path.join('images', 'thumb', 'sphx_glr_%s_thumb.*' % base)]
+    for pattern in patterns:
+        files += sorted(os.path.relpath(path, target_dir) for path in
+                        glob.glob(os.path.join(target_dir, pattern)))
+    return files
+
+
+def _copy_files(files, from_dir, to_dir):
+    for name in files:
+        dest = os.path.join(to_dir, name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy2(os.path.join(from_dir, name), dest)
+
+
+class GalleryCache(object):
+    """
+    On-disk cache of the gallery output of the examples.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory holding the cache.  Each example has an entry directory
+        (mirroring its path below the documentation source directory) with a
+        ``manifest.json`` and a copy of its gallery output.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.record_dir = os.path.join(cache_dir, 'records')
+        self.digests = load_digests(cache_dir)
+        self.versions = library_versions()
+
+    def entry_dir(self, src_dir, fname, srcdir):
+        return os.path.join(self.cache_dir, 'examples',
+                            os.path.relpath(src_dir, srcdir), fname)
+
+    def load_manifest(self, entry_dir):
+        manifest = os.path.join(entry_dir, 'manifest.json')
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest) as fid:
+            return json.load(fid)
+
+    def inputs_match(self, manifest):
+        """Return True if the library versions and every recorded input of
+        a manifest are unchanged."""
+        if manifest['versions'] != self.versions:
+            return False
+        for path, digest in manifest['inputs'].items():
+            if not os.path.isfile(path) or \
+                    file_digest(path, self.digests) != digest:
+                return False
+        return True
+
+    def store(self, src_dir, target_dir, fname, srcdir, inputs):
+        """Copy the output of an example that ran into its cache entry."""
+        entry_dir = self.entry_dir(src_dir, fname, srcdir)
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        files = _output_files(target_dir, fname)
+        _copy_files(files, target_dir, os.path.join(entry_dir, 'output'))
+        manifest = {
+            'script': get_md5sum(os.path.join(src_dir, fname)),
+            'inputs': {path: file_digest(path, self.digests)
+                       for path in inputs if os.path.isfile(path)},
+            'versions': self.versions,
+            'files': files,
+        }
+        with atomic_write(os.path.join(entry_dir, 'manifest.json'),
+                          'w') as fid:
+            json.dump(manifest, fid, indent=1, sort_keys=True)
+
+    def restore(self, entry_dir, manifest, target_dir):
+        _copy_files(manifest['files'], os.path.join(entry_dir, 'output'),
+                    target_dir)
+
+    def save_digests(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        save_digests(self.cache_dir, self.digests)
+
+
+###############################################################################
+# Sphinx events
+
+def _cache_dir(app):
+    if not app.config.gallery_cache_dir:
+        return None
+    return os.path.join(app.srcdir, app.config.gallery_cache_dir)
+
+
+def add_input_recorder(app, config):
+    """Register ``record_inputs`` as a sphinx-gallery module resetter."""
+    cache_dir = _cache_dir(app)
+    if cache_dir is None:
+        return
+    conf = config.sphinx_gallery_conf
+    resetters = conf.get('reset_modules', ('matplotlib', 'seaborn'))
+    if not isinstance(resetters, (tuple, list)):
+        resetters = (resetters,)
+    conf['reset_modules'] = tuple(resetters) + (record_inputs,)
+    conf['gallery_cache_dir'] = cache_dir
+
+
+def restore_cached_examples(app):
+    """Restore the output of unchanged examples and mark the examples whose
+    inputs changed as stale."""
+    cache_dir = _cache_dir(app)
+    if cache_dir is None:
+        return
+    cache = GalleryCache(cache_dir)
+    if os.path.exists(cache.record_dir):
+        shutil.rmtree(cache.record_dir)
+
+    srcdir = app.builder.srcdir
+    restored, invalidated = 0, 0
+    for src_dir, target_dir, fname in collect_examples(complete_conf(app)):
+        entry_dir = cache.entry_dir(src_dir, fname, srcdir)
+        manifest = cache.load_manifest(entry_dir)
+        current = is_current(src_dir, target_dir, fname)
+        if manifest is None:
+            # The inputs of an example whose output predates the cache are
+            # unknown: it is executed once more to record them
+            if current:
+                os.remove(os.path.join(target_dir, fname) + '.md5')
+                invalidated += 1
+            continue
+        if manifest['script'] == get_md5sum(os.path.join(src_dir, fname)) \
+                and cache.inputs_match(manifest):
+            if not current:
+                cache.restore(entry_dir, manifest, target_dir)
+                restored += 1
+        elif current:
+            os.remove(os.path.join(target_dir, fname) + '.md5')
+            invalidated += 1
+    cache.save_digests()
+    logger.info('gallery cache: %d examples restored, %d invalidated'
+                % (restored, invalidated), color='white')
+
+
+def store_executed_examples(app, exception):
+    """Store the output of every example that ran in this build."""
+    cache_dir = _cache_dir(app)
+    if cache_dir is None or exception is not None:
+        return
+    cache = GalleryCache(cache_dir)
+    if not os.path.exists(cache.record_dir):
+        return
+
+    srcdir = app.builder.srcdir
+    stored = 0
+    for src_dir, target_dir, fname in collect_examples(complete_conf(app)):
+        record = _record_path(cache_dir, os.path.relpath(
+            os.path.join(src_dir, fname), srcdir))
+        # Examples that failed have no md5 file and are not cached
+        if not os.path.exists(record) or \
+                not is_current(src_dir, target_dir, fname):
+            continue
+        with open(record) as fid:
+            inputs = json.load(fid)
+        cache.store(src_dir, target_dir, fname, srcdir, inputs)
+        stored += 1
+    shutil.rmtree(cache.record_dir)
+    cache.save_digests()
+    logger.info('gallery cache: %d examples stored' % stored, color='white')
+
+
+def setup(app):
+    app.add_config_value('gallery_cache_dir', '', '')
+    if not is_supported():
+        logger.warning('gallery_tools.cache does not support sphinx-gallery '
+                       '%s: the gallery output is not cached'
+                       % sphinx_gallery.__version__)
+        return {'parallel_read_safe': True, 'parallel_write_safe': True}
+    app.connect('config-inited', add_input_recorder)
+    # Connected before gallery_tools.parallel and sphinx_gallery.gen_gallery
+    # (see the extensions order in conf.py)
+    app.connect('builder-inited', restore_cached_examples)
+    app.connect('env-before-read-docs', stop_recording)
+    app.connect('build-finished', store_executed_examples)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
@@ -0,0 +1,344 @@
+"""
+climatology.py
+==============
+Climatologies (time means) of the variables of a file, computed without
+loading the whole time series, cached on disk, and the anomalies from them.
+
+``var.isel(time=0) - var.mean('time')`` loads the full ``(time, lat, lon)``
+cube into memory to draw one anomaly map.  ``time_mean`` reads the series
+one block of time steps at a time (see ``gallery_tools.stats``) and
+accumulates the sums and counts of each block, so its memory use does not
+grow with the length of the series.  Means may be grouped by the month or
+the day of the year of each time step (e.g. a 30-year daily climatology).
+
+``climatology`` computes the time mean of a variable of a file over a period
+and caches it on disk, keyed by the content hash of the file, the variable,
+the period, the grouping and the opening arguments: it is computed once,
+and rewritten when the file changes.  ``anomaly`` and ``anomalies`` then
+read one time step of the file at a time and subtract the cached
+climatology from it.
+
+``baseline`` caches the reference-period mean of a series that is not read
+straight from a file, such as a global mean or the ensemble of
+``NCL_xy_18.py``.  It is keyed by the name of the series, the period, a
+``key`` naming how the series is derived, and the content hash of the files
+it is derived from: plotting its anomalies again is then a subtraction of a
+cached array, and the baseline is computed again when one of the files
+changes.
+
+Grouping by month or day of year needs decoded times (the default of
+``xr.open_dataset``).  ``anomaly`` and ``anomalies`` take the arguments of
+``climatology`` and find its cached result only when they are the same.
+
+Usage::
+
+    period = ('1891', '1920')
+    clim = climatology(path, 'TS', period=period, groupby='month')
+    first = anomaly(path, 'TS', 0, period=period, groupby='month')
+    for step in anomalies(path, 'TS', period=period, groupby='month'):
+        ...
+    gavan = anomaly_series(gavn, ('1890', '1920'), 'global mean',
+                           sources=nfiles)
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from gallery_tools import stats, zarr_cache
+from gallery_tools.data import _freeze
+from gallery_tools.fingerprint import (atomic_write, file_digest, load_digests,
+                                       save_digests)
+from gallery_tools.runner import REPO_DIR
+
+# Directory of the cached climatologies (an empty string disables the cache)
+DEFAULT_CACHE_DIR = os.environ.get(
+    'GALLERY_CLIMATOLOGY_DIR',
+    os.path.join(REPO_DIR, '_build', 'climatology_cache'))
+
+# Baselines computed or loaded in this process, by key
+_baselines = {}
+
+
+def group_labels(time, groupby=None):
+    """
+    Return the group of each time step: ``groupby`` names an attribute of
+    the ``dt`` accessor of the (decoded) times, e.g. ``'month'`` or
+    ``'dayofyear'``.  Without ``groupby``, every step is in group 0.
+    """
+    if groupby is None:
+        return np.zeros(time.size, dtype=int)
+    return np.asarray(getattr(time.dt, groupby).values)
+
+
+def time_mean(var, dim='time', groupby=None, block_bytes=None, jobs=None):
+    """
+    Mean of ``var`` over ``dim``, optionally by group of time steps,
+    reading ``var`` one block of steps at a time.
+
+    Missing values are skipped, as in xarray's ``mean``.
+
+    Parameters
+    ----------
+    var : xarray.DataArray
+        The series, in memory, lazily indexed or dask-backed.
+    dim : str
+        The time dimension.
+    groupby : str, optional
+        Group the steps by this attribute of their times (see
+        ``group_labels``), e.g. ``'month'`` or ``'dayofyear'``.
+    block_bytes : int, optional
+        Size of the blocks of ``var`` read at a time
+        (``stats.DEFAULT_BLOCK_BYTES`` by default).
+    jobs : int, optional
+        Number of threads (the CPU count by default).
+
+    Returns
+    -------
+    xarray.DataArray
+        The mean, in memory, with a ``groupby`` dimension (of the groups
+        present in ``var``, in sorted order) in place of ``dim`` if grouped.
+    """
+    var = var.transpose(dim, ...)
+    groups = np.unique(group_labels(var[dim], groupby))
+    dtype = np.promote_types(var.dtype, np.float64)
+
+    def reduce(block):
+        # The sums and counts of the valid values of each group of the block
+        index = np.searchsorted(groups, group_labels(block[dim], groupby))
+        values = stats._values(block)
+        valid = ~np.isnan(values) if values.dtype.kind in 'fc' else \
+            np.ones(values.shape, dtype=bool)
+        values = np.where(valid, values, 0)
+        return [(group, values[index == group].sum(axis=0, dtype=dtype),
+                 valid[index == group].sum(axis=0))
+                for group in np.unique(index)]
+
+    sums = np.zeros((groups.size,) + var.shape[1:], dtype=dtype)
+    counts = np.zeros(sums.shape, dtype=np.int64)
+    blocks = stats._blocks(var, block_bytes or stats.DEFAULT_BLOCK_BYTES)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        # The partial sums are added up as the blocks are reduced
+        for part in pool.map(reduce, blocks):
+            for group, block_sum, block_count in part:
+                sums[group] += block_sum
+                counts[group] += block_count
+    with np.errstate(invalid='ignore'):
+        mean = (sums / counts).astype(np.promote_types(var.dtype,
+                                                        np.float32))
+    coords = stats._reduced_coords(var, (dim,))
+    if groupby is None:
+        return xr.DataArray(mean[0], dims=var.dims[1:], coords=coords,
+                            name=var.name, attrs=var.attrs)
+    coords[groupby] = groups
+    return xr.DataArray(mean, dims=(groupby,) + var.dims[1:], coords=coords,
+                        name=var.name, attrs=var.attrs)
+
+
+def _open(path, **kwargs):
+    """Open a file lazily (bypassing the in-memory dataset cache of
+    ``gallery_tools.data``, which would load the whole series)."""
+    return zarr_cache.open_dataset(
+        path, netcdf_opener=getattr(xr.open_dataset, '__wrapped__',
+                                    xr.open_dataset), **kwargs)
+
+
+def _select_period(var, period, dim='time'):
+    if period is None:
+        return var
+    start, end = period
+    return var.sel({dim: slice(start, end)})
+
+
+def climatology(path, variable, period=None, groupby=None, dim='time',
+                cache_dir=None, block_bytes=None, jobs=None, **kwargs):
+    """
+    Return the time mean of a variable of a file over a period, from the
+    disk cache if it was computed before from the same file.
+
+    Parameters
+    ----------
+    path : str
+        The file.
+    variable : str
+        The name of the variable.
+    period : tuple, optional
+        ``(start, end)`` labels of the first and last time steps of the
+        period (inclusive, as in ``var.sel(time=slice(start, end))``; the
+        whole series by default).
+    groupby : str, optional
+        Group the steps by this attribute of their times, e.g. ``'month'``
+        or ``'dayofyear'`` (see ``time_mean``).
+    dim : str
+        The time dimension.
+    cache_dir : str, optional
+        Directory of the cached climatologies (``DEFAULT_CACHE_DIR`` by
+        default).  An empty string disables the cache.
+    block_bytes, jobs
+        Passed on to ``time_mean``.
+    **kwargs
+        Passed on to ``xarray.open_dataset``.
+
+    Returns
+    -------
+    xarray.DataArray
+        The climatology, in memory.
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    fname = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.realpath(path)
+        digests = load_digests(cache_dir)
+        key = hashlib.blake2b(repr((
+            file_digest(path, digests), variable, _freeze(period), groupby,
+            dim, _freeze(kwargs))).encode(), digest_size=16).hexdigest()
+        save_digests(cache_dir, digests)
+        fname = os.path.join(cache_dir, '%s-%s.nc' % (variable, key))
+        if os.path.exists(fname):
+            with xr.open_dataarray(fname) as clim:
+                return clim.load()
+
+    with _open(path, **kwargs) as ds:
+        var = _select_period(ds[variable], period, dim)
+        clim = time_mean(var, dim, groupby, block_bytes, jobs)
+    if fname:
+        with atomic_write(fname, None) as tmp:
+            clim.to_netcdf(tmp)
+    return clim
+
+
+def subtract(var, clim, groupby=None, dim='time'):
+    """Return the anomaly of ``var`` from the climatology ``clim`` (grouped
+    by ``groupby``), matching each time step to its group."""
+    if groupby is None:
+        return var - clim
+    labels = group_labels(var[dim], groupby)
+    if var[dim].ndim == 0:
+        return var - clim.sel({groupby: labels.item()})
+    groups = xr.DataArray(labels, dims=var[dim].dims)
+    return var - clim.sel({groupby: groups}).drop_vars(groupby)
+
+
+def anomaly(path, variable, index, period=None, groupby=None, dim='time',
+            cache_dir=None, **kwargs):
+    """
+    Return the anomaly of time step ``index`` of a variable of a file from
+    its (cached) ``climatology``, reading only that step of the file.
+
+    The arguments are those of ``climatology``.
+    """
+    clim = climatology(path, variable, period, groupby, dim, cache_dir,
+                       **kwargs)
+    with _open(path, **kwargs) as ds:
+        var = ds[variable].isel({dim: index}).load()
+    return subtract(var, clim, groupby, dim)
+
+
+def anomalies(path, variable, period=None, groupby=None, dim='time',
+              cache_dir=None, **kwargs):
+    """
+    Yield the anomaly of every time step of a variable of a file from its
+    (cached) ``climatology``, reading one step of the file at a time.
+
+    The arguments are those of ``climatology``.
+    """
+    clim = climatology(path, variable, period, groupby, dim, cache_dir,
+                       **kwargs)
+    with _open(path, **kwargs) as ds:
+        var = ds[variable]
+        for index in range(var.sizes[dim]):
+            yield subtract(var.isel({dim: index}).load(), clim, groupby, dim)
+
+
+def baseline_key(var, period, key, sources=(), dim='time', digests=None):
+    """
+    Return the cache key of the baseline of ``var``: a hash of its name,
+    its dimensions and coordinates other than ``dim``, the period and
+    ``key``, and of the content of the ``sources`` files.
+    """
+    if key is None:
+        raise ValueError('a key is needed to tell apart the baselines of '
+                         'different series')
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((var.name, _freeze(period), dim, key,
+                        tuple((d, size) for d, size in var.sizes.items()
+                              if d != dim))).encode())
+    for name, coord in stats._reduced_coords(var, (dim,)).items():
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(coord.values).tobytes())
+    for path in sources:
+        digest.update(file_digest(os.path.realpath(path), digests).encode())
+    return digest.hexdigest()
+
+
+def baseline(var, period, key, sources=(), dim='time', cache_dir=None):
+    """
+    Return the mean of a series over a reference period, from memory or
+    from the disk cache if it was computed before for the same series.
+
+    Parameters
+    ----------
+    var : xarray.DataArray
+        The series (e.g. ``(case, time)``), in memory or lazy: on a cache
+        hit, it is not computed.
+    period : tuple
+        ``(start, end)`` labels of the first and last time steps of the
+        reference period (inclusive).
+    key : str
+        Names how the series is derived (e.g. ``'global mean'``), telling
+        apart the series derived from the same files in different ways.
+        Without ``sources``, it is all that identifies the series, so it
+        must change when the series does.
+    sources : sequence of str, optional
+        The files the series is derived from.  Their content hash keys the
+        baseline, which is computed again when one of them changes.
+    dim : str
+        The time dimension.
+    cache_dir : str, optional
+        Directory of the cached baselines (``DEFAULT_CACHE_DIR`` by
+        default).  An empty string only caches baselines in memory.
+
+    Returns
+    -------
+    xarray.DataArray
+        The baseline, in memory, without the ``dim`` dimension.
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    digests = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        if sources:
+            digests = load_digests(cache_dir)
+    name = baseline_key(var, period, key, sources, dim, digests)
+    if digests is not None:
+        save_digests(cache_dir, digests)
+    if name in _baselines:
+        return _baselines[name]
+    fname = os.path.join(cache_dir, 'baseline-%s.nc' % name) \
+        if cache_dir else None
+    if fname and os.path.exists(fname):
+        with xr.open_dataarray(fname) as mean:
+            mean = mean.load()
+    else:
+        mean = _select_period(var, period, dim).mean(dim).compute()
+        if fname:
+            with atomic_write(fname, None) as tmp:
+                mean.to_netcdf(tmp)
+    _baselines[name] = mean
+    return mean
+
+
+def anomaly_series(var, period, key, sources=(), dim='time', cache_dir=None):
+    """
+    Return the anomaly of a series from its (cached) ``baseline`` over a
+    reference period.
+
+    The arguments are those of ``baseline``.
+    """
+    return var - baseline(var, period, key, sources, dim, cache_dir)
@@ -0,0 +1,338 @@
+"""
+contour.py
+==========
+Filled contours and contour lines of the same field from one contouring
+pass.
+
+Many examples draw a field with ``contourf`` and then outline the same
+levels with ``contour`` (often labelled with ``clabel``).  Matplotlib runs
+the contouring algorithm once for the filled bands and once more for the
+lines, although a contour line at a level is exactly the boundary between
+the band below the level and the band above it.
+
+``SharedContourGenerator`` wraps the contourpy generator that matplotlib
+creates for a field and keeps the filled bands it computes.  The lines of a
+level bounded by two computed bands are then taken from the segments the two
+bands have in common, in the order of the rings of the band above, instead
+of being contoured again.  Other levels (e.g. the first and last ones when
+the levels do not span the data) are contoured as usual, and levels outside
+the range of the data have no lines.
+
+The filled bands and lines of a field are also saved on disk, in
+``DEFAULT_CACHE_DIR``, keyed by a hash of the coordinates and values of the
+field, the generator options and the levels.  Drawing the same field again
+(in another style, figure size, projection or build) loads its contours
+without contouring it at all.
+
+``install`` makes matplotlib share the generators of identical fields (same
+coordinates, values, mask and options) between its contour sets, which is
+how the batch renderer and the parallel gallery workers use it without
+changing the examples.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from gallery_tools.fingerprint import (array_digest, atomic_write,
+                                       library_versions)
+from gallery_tools.runner import REPO_DIR
+
+# Number of fields whose generators (and filled bands) are kept
+DEFAULT_CACHE_SIZE = 8
+
+# Directory of the contour cache (an empty string disables it)
+DEFAULT_CACHE_DIR = os.environ.get(
+    'GALLERY_CONTOUR_DIR', os.path.join(REPO_DIR, '_build', 'contour_cache'))
+
+# Path codes of contourpy's OuterCode and SeparateCode formats
+MOVETO = 1
+LINETO = 2
+CLOSEPOLY = 79
+
+# Shared generators, by field key, most recently used last
+_generators = OrderedDict()
+
+
+def field_key(x, y, z, **options):
+    """Return a key identifying the contours of ``z`` on the grid ``x``,
+    ``y``, with the generator ``options`` and the installed libraries."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(sorted(library_versions().items())).encode())
+    digest.update(repr(sorted((name, str(value)) for name, value in
+                              options.items())).encode())
+    for values in (x, y, z):
+        array_digest(digest, values)
+    return digest.hexdigest()
+
+
+def _point_keys(points, origin, scale):
+    """
+    Return an integer key for each point, equal for points closer than
+    about ``2**-28`` of the extent of the field.
+
+    The bands on either side of a level interpolate the same crossings of
+    the level in opposite directions, which may differ in the last bit.
+    """
+    cells = np.rint((points - origin) * scale).astype(np.int64)
+    return cells[:, 0] * (2 ** 31) + cells[:, 1]
+
+
+class _Band(object):
+    """The rings of a filled band (in contourpy's OuterCode format), with
+    their segments and the sorted keys of their points."""
+
+    def __init__(self, filled, origin, scale):
+        if filled[0]:
+            self.points = np.concatenate(filled[0])
+            codes = np.concatenate(filled[1])
+        else:
+            self.points = np.empty((0, 2))
+            codes = np.empty(0, dtype=np.uint8)
+        self.starts = np.flatnonzero(codes == MOVETO)
+        # A segment joins each point to the next one of the same ring
+        self.segments = np.flatnonzero(codes[1:] != MOVETO)
+        self.keys = _point_keys(self.points, origin, scale)
+        self.sorted_keys = np.sort(self.keys)
+
+    def contains(self, keys):
+        """Return whether each point key is a key of the band."""
+        if not len(self.sorted_keys):
+            return np.zeros(len(keys), dtype=bool)
+        index = np.searchsorted(self.sorted_keys, keys)
+        index[index == len(self.sorted_keys)] = 0
+        return self.sorted_keys[index] == keys
+
+
+def _shared_runs(ring, shared):
+    """Split a (closed) ring into the runs of its segments flagged as
+    ``shared``."""
+    # Start the ring at a segment that is not shared, so that no run wraps
+    # around the end of the ring
+    first = int(np.argmin(shared))
+    ring = np.concatenate([ring[first:-1], ring[:first + 1]])
+    shared = np.roll(shared, -first)
+    flags = np.diff(np.concatenate([[0], shared.astype(np.int8), [0]]))
+    return [ring[start:end + 1] for start, end in
+            zip(np.flatnonzero(flags == 1), np.flatnonzero(flags == -1))]
+
+
+def _line_codes(length, closed):
+    codes = np.full(length, LINETO, dtype=np.uint8)
+    codes[0] = MOVETO
+    if closed:
+        codes[-1] = CLOSEPOLY
+    return codes
+
+
+def lines_between(below, above):
+    """
+    Return the contour lines at the level between two adjacent filled
+    ``_Band``s, in contourpy's SeparateCode format.
+    """
+    points, starts, segments = above.points, above.starts, above.segments
+    if not len(below.segments) or not len(segments):
+        return [], []
+    # The points of the band above on the level are those of the band below
+    # too, and a segment of the band above is on the level if both its ends
+    # are (two crossings of the level are never joined along a cell side)
+    on_level = below.contains(above.keys)
+    shared = on_level[segments] & on_level[segments + 1]
+    ring_of = np.searchsorted(starts, segments, side='right') - 1
+    counts = np.bincount(ring_of, minlength=len(starts))
+    shared_counts = np.bincount(ring_of, weights=shared,
+                                minlength=len(starts))
+    ends = np.append(starts[1:], len(points))
+    lines = []
+    for ring in np.flatnonzero(shared_counts):
+        ring_points = points[starts[ring]:ends[ring]]
+        if shared_counts[ring] == counts[ring]:
+            # A closed contour line
+            lines.append((ring_points, True))
+        else:
+            lines.extend((line, False) for line in _shared_runs(
+                ring_points, shared[ring_of == ring]))
+    # In (about) the order contourpy finds the lines: those that start on a
+    # boundary first, then the closed ones, scanning the grid by rows
+    lines.sort(key=lambda line: (line[1], line[0][0, 1], line[0][0, 0]))
+    return ([line for line, closed in lines],
+            [_line_codes(len(line), closed) for line, closed in lines])
+
+
+def _save_contours(fname, contours):
+    """Save contours in contourpy's OuterCode or SeparateCode format (a list
+    of point arrays and a list of code arrays)."""
+    points, codes = contours
+    lengths = [len(part) for part in points]
+    with atomic_write(fname) as fid:
+        np.savez(fid, lengths=np.asarray(lengths, dtype=np.int64),
+                 points=np.concatenate(points) if points else
+                 np.empty((0, 2)),
+                 codes=np.concatenate(codes) if codes else
+                 np.empty(0, dtype=np.uint8))
+
+
+def _load_contours(fname):
+    with np.load(fname) as saved:
+        lengths, points, codes = \
+            saved['lengths'], saved['points'], saved['codes']
+    bounds = np.cumsum(lengths)[:-1]
+    if not len(lengths):
+        return [], []
+    return np.split(points, bounds), np.split(codes, bounds)
+
+
+class SharedContourGenerator(object):
+    """
+    A contourpy generator (created with the ``SeparateCode`` line type and
+    the ``OuterCode`` fill type, as matplotlib does) that keeps its filled
+    bands and draws lines from them.
+
+    Parameters
+    ----------
+    generator : contourpy.ContourGenerator, or callable
+        The generator of the field, or a function creating it (called when
+        a contour is not in the cache).
+    x, y : array-like
+        The coordinates of the field.
+    z : array-like
+        The (possibly masked) values of the field.
+    key : str, optional
+        The ``field_key`` of the field, under which its contours are saved
+        in ``cache_dir``.
+    cache_dir : str, optional
+        Directory of the contour cache (``DEFAULT_CACHE_DIR`` by default; an
+        empty string disables it).
+    """
+
+    def __init__(self, generator, x, y, z, key=None, cache_dir=None):
+        self._generator = generator
+        self.key = key
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        z = np.ma.masked_invalid(z, copy=False)
+        self.zmin = float(z.min()) if z.count() else np.nan
+        self.zmax = float(z.max()) if z.count() else np.nan
+        x, y = np.ma.getdata(x), np.ma.getdata(y)
+        self._origin = np.array([np.nanmin(x), np.nanmin(y)])
+        extent = np.array([np.nanmax(x), np.nanmax(y)]) - self._origin
+        self._scale = 2 ** 28 / np.maximum(extent, np.finfo(float).tiny)
+        self._filled = {}
+        self._bands = {}
+
+    @property
+    def generator(self):
+        """The contourpy generator of the field."""
+        if callable(self._generator) and \
+                not hasattr(self._generator, 'create_contour'):
+            self._generator = self._generator()
+        return self._generator
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.generator, name)
+
+    def _cached(self, kind, levels, compute):
+        """Return contours from the disk cache, or ``compute`` and save
+        them."""
+        if not (self.cache_dir and self.key):
+            return compute()
+        name = hashlib.blake2b(repr((kind,) + levels).encode(),
+                               digest_size=8).hexdigest()
+        fname = os.path.join(self.cache_dir, self.key, name + '.npz')
+        if os.path.exists(fname):
+            return _load_contours(fname)
+        contours = compute()
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        _save_contours(fname, contours)
+        return contours
+
+    def create_filled_contour(self, lower, upper):
+        key = (float(lower), float(upper))
+        if key not in self._filled:
+            self._filled[key] = self._cached(
+                'filled', key,
+                lambda: self.generator.create_filled_contour(lower, upper))
+        return self._filled[key]
+
+    def _band(self, lower=None, upper=None):
+        """Return the ``_Band`` of a computed band with the given lower or
+        upper level, or None."""
+        for key, filled in self._filled.items():
+            if key[0] == lower or key[1] == upper:
+                if key not in self._bands:
+                    self._bands[key] = _Band(filled, self._origin,
+                                             self._scale)
+                return self._bands[key]
+        return None
+
+    def create_contour(self, level):
+        level = float(level)
+        if not self.zmin <= level <= self.zmax:
+            return [], []
+        return self._cached('lines', (level,),
+                            lambda: self._lines(level))
+
+    def _lines(self, level):
+        below, above = self._band(upper=level), self._band(lower=level)
+        if below is None or above is None or level == self.zmin:
+            return self.generator.create_contour(level)
+        return lines_between(below, above)
+
+    # contourpy's names of the same methods
+    filled = create_filled_contour
+    lines = create_contour
+
+
+def shared_generator(contour_generator, x, y, z, cache_size=None,
+                     cache_dir=None, **options):
+    """
+    Return the ``SharedContourGenerator`` of a field, which creates its
+    generator with ``contour_generator(x, y, z, **options)`` when it first
+    needs it.
+    """
+    key = field_key(x, y, z, **options)
+    if key in _generators:
+        _generators.move_to_end(key)
+        return _generators[key]
+    generator = SharedContourGenerator(
+        lambda: contour_generator(x, y, z, **options), x, y, z, key,
+        cache_dir)
+    _generators[key] = generator
+    while len(_generators) > (cache_size or DEFAULT_CACHE_SIZE):
+        _generators.popitem(last=False)
+    return generator
+
+
+def install(cache_size=None, cache_dir=None):
+    """
+    Make the contourpy generators matplotlib creates shared between the
+    contour sets of identical fields, and their contours cached in
+    ``cache_dir`` (see ``SharedContourGenerator``).
+
+    Generators created with other line or fill types than matplotlib's are
+    left as they are.
+    """
+    try:
+        import contourpy
+    except ImportError:
+        # matplotlib < 3.6 contours with its own extension
+        return
+    if getattr(contourpy.contour_generator, '_shared_contours', False):
+        return
+    contour_generator = contourpy.contour_generator
+
+    def shared_contour_generator(x=None, y=None, z=None, **options):
+        if options.get('line_type') != contourpy.LineType.SeparateCode or \
+                options.get('fill_type') != contourpy.FillType.OuterCode or \
+                x is None or y is None:
+            return contour_generator(x, y, z, **options)
+        return shared_generator(contour_generator, x, y, z, cache_size,
+                                cache_dir, **options)
+
+    shared_contour_generator.__doc__ = contour_generator.__doc__
+    shared_contour_generator.__wrapped__ = contour_generator
+    shared_contour_generator._shared_contours = True
+    contourpy.contour_generator = shared_contour_generator
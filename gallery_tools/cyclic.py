@@ -0,0 +1,106 @@
+"""
+cyclic.py
+=========
+Add a cyclic point to a field without copying it.
+
+Global fields on a 0 to 360 degree (or -180 to 180) grid leave a gap at the
+periodic boundary when contoured, unless the first longitude is repeated
+after the last one.  ``cartopy.util.add_cyclic_point(da.values, ...)``
+loads the whole field and copies it into an array one column wider, so a
+3-D or 4-D field of which only one time step is drawn occupies twice its
+size in memory at the peak.
+
+``add_cyclic`` returns the wrapped field as a dask array over the original
+one instead: the first column is appended lazily, so nothing is copied
+until a selection of the wrapped field is used, e.g. by
+``.isel(time=0).plot.contourf()``, and then only that selection is read
+(from the file, for a lazily opened dataset) and copied.  A field in memory
+is wrapped without a copy, and dask-backed fields keep their chunks.
+
+Usage::
+
+    ds = xr.open_dataset(path)
+    ts = add_cyclic(ds.TS, 'lon')
+    ts.isel(time=0).plot.contourf(ax=ax, transform=ccrs.PlateCarree())
+"""
+
+import numpy as np
+import xarray as xr
+
+
+class _VariableView(object):
+    """Array-like reading the selections of an ``xarray.Variable`` (in
+    memory or lazily indexed from a file) as numpy arrays.
+
+    ``dask.array.from_array`` copies a numpy array it is given; wrapped in
+    this, the array is only sliced when a chunk is computed.
+    """
+
+    def __init__(self, variable):
+        self.variable = variable
+        self.shape = variable.shape
+        self.dtype = variable.dtype
+        self.ndim = variable.ndim
+
+    def __getitem__(self, key):
+        return self.variable[key].values
+
+
+def cyclic_coordinate(values, period=None):
+    """Return 1-D coordinate ``values`` with the first value repeated one
+    step (or ``period``) after the last one, in the same units."""
+    values = np.asarray(values)
+    if period is not None:
+        last = values[0] + period
+    elif values.size > 1:
+        last = values[-1] + (values[1] - values[0])
+    else:
+        last = values[0] + 360
+    return np.append(values, last)
+
+
+def add_cyclic(da, dim='lon', period=None):
+    """
+    Return ``da`` with the first point along ``dim`` repeated after the
+    last one, without reading or copying its values.
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        The field, in memory, lazily loaded from a file, or dask-backed.
+    dim : str
+        The periodic dimension (the longitude).
+    period : float, optional
+        The period of the coordinate of ``dim`` (by default, the added
+        coordinate is one grid step after the last one).
+
+    Returns
+    -------
+    xarray.DataArray
+        The wrapped field, dask-backed, with the name, attributes and
+        encoding of ``da``.  Its coordinates along
+        ``dim`` are wrapped as well.
+    """
+    import dask.array
+
+    axis = da.get_axis_num(dim)
+    if da.chunks is not None:
+        data = da.data
+    else:
+        # One chunk per 2-D slice (and the whole of dim), so that a selection
+        # of the wrapped field only reads the slices it needs
+        chunks = [1] * max(da.ndim - 2, 0) + list(da.shape[-2:])
+        chunks[axis] = da.shape[axis]
+        data = dask.array.from_array(_VariableView(da.variable),
+                                     chunks=tuple(chunks), name=False)
+    data = dask.array.concatenate(
+        [data, data[(slice(None),) * axis + (slice(0, 1),)]], axis=axis)
+    coords = da.coords.to_dataset().isel(
+        {dim: np.append(np.arange(da.sizes[dim]), 0)}, missing_dims='ignore')
+    if dim in da.coords:
+        coords[dim] = (dim, cyclic_coordinate(da[dim].values, period),
+                       da[dim].attrs)
+    wrapped = xr.DataArray(data, dims=da.dims, coords=coords.coords,
+                           name=da.name, attrs=da.attrs)
+    wrapped.encoding = dict(da.encoding)
+    return wrapped
@@ -0,0 +1,292 @@
+"""
+data.py
+=======
+Data access layer for running many examples in one process.
+
+Several examples open the same files (``uv300.nc`` is read by seven of them,
+``uvt.nc`` and ``atmos.nc`` by several more).  ``DatasetCache`` keeps the
+opened and CF-decoded ``xarray.Dataset`` of each file, in least-recently-used
+order within a memory budget, so that a batch run opens and decodes each file
+once.  The datasets are kept lazy: each example reads only the variables and
+slices it selects.
+
+The cache is keyed by the real path of the file (``geocat.datafiles.get``
+returns a plain path, so its files are cached like any other), its size and
+modification time, and the ``open_dataset`` keyword arguments.  Callers get a
+shallow copy of the cached dataset: replacing attributes, coordinates or
+variables does not affect other callers, but the index coordinates are
+shared and must not be modified in place.
+
+``install`` routes ``xarray.open_dataset`` through a cache, which is how the
+batch renderer and the parallel gallery workers use it without changing the
+examples.
+
+``open_subset`` reads only the slice of a file a plot needs (selected
+indices, labels and map extent).
+
+Every file is read from its Zarr copy when there is an up-to-date one (see
+``gallery_tools.zarr_cache``).
+"""
+
+import functools
+import os
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+from gallery_tools import zarr_cache
+
+# Default memory budget of the process-wide cache, in MB
+DEFAULT_BUDGET_MB = float(os.environ.get('GALLERY_DATA_CACHE_MB', 2048))
+
+
+def _freeze(value):
+    """Return a hashable equivalent of a keyword argument value."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def _resident_bytes(ds):
+    """Return the memory held by a lazily opened dataset: its index
+    coordinates, which xarray loads when it opens the file."""
+    return sum(ds[name].nbytes for name in ds.indexes)
+
+
+class DatasetCache(object):
+    """
+    LRU cache of opened and decoded ``xarray.Dataset`` objects.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memory budget.  Each dataset is charged the memory it holds (its
+        index coordinates, the other variables being read lazily).  The least
+        recently used datasets are evicted when the total exceeds the budget;
+        a dataset holding more than the whole budget is returned without
+        being cached.
+    opener : callable, optional
+        The function opening a file, ``gallery_tools.zarr_cache.open_dataset``
+        (which reads the Zarr copy of the file if there is one) by default.
+    """
+
+    def __init__(self, max_bytes, opener=None):
+        self.max_bytes = max_bytes
+        self.opener = opener if opener is not None else \
+            zarr_cache.open_dataset
+        self._datasets = OrderedDict()
+        self._sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        return sum(self._sizes.values())
+
+    def key(self, path, **kwargs):
+        path = os.path.realpath(os.fspath(path))
+        stat = os.stat(path)
+        return (path, stat.st_size, stat.st_mtime_ns, _freeze(kwargs))
+
+    def open_dataset(self, path, **kwargs):
+        """
+        Open a file like ``xarray.open_dataset``, reusing the cached dataset
+        when the same file was opened before with the same arguments.
+
+        The dataset is not loaded: the data an example selects is read
+        when it is used (into the example's copy, not the cached dataset),
+        and a dataset opened with ``chunks`` stays dask-backed.
+        """
+        key = self.key(path, **kwargs)
+        if key in self._datasets:
+            self._datasets.move_to_end(key)
+            self.hits += 1
+            return self._datasets[key].copy(deep=False)
+
+        self.misses += 1
+        ds = self.opener(path, **kwargs)
+        nbytes = _resident_bytes(ds)
+        if nbytes > self.max_bytes:
+            return ds
+        self._datasets[key] = ds
+        self._sizes[key] = nbytes
+        self._evict()
+        return ds.copy(deep=False)
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._datasets) > 1:
+            key, ds = self._datasets.popitem(last=False)
+            del self._sizes[key]
+            ds.close()
+
+    def clear(self):
+        for ds in self._datasets.values():
+            ds.close()
+        self._datasets.clear()
+        self._sizes.clear()
+
+
+# The process-wide cache (see ``install``)
+_cache = None
+
+
+def get_cache():
+    """Return the process-wide ``DatasetCache``, creating it on first use."""
+    global _cache
+    if _cache is None:
+        _cache = DatasetCache(int(DEFAULT_BUDGET_MB * 2 ** 20))
+    return _cache
+
+
+def open_dataset(path, **kwargs):
+    """``xarray.open_dataset`` through the process-wide cache."""
+    return get_cache().open_dataset(path, **kwargs)
+
+
+def install(budget_mb=None):
+    """
+    Route ``xarray.open_dataset`` through the process-wide cache.
+
+    Calls with anything other than a path (file objects, stores) go straight
+    to xarray.  Returns the cache.
+    """
+    global _cache
+    if getattr(xr.open_dataset, '_dataset_cache', None) is not None:
+        return xr.open_dataset._dataset_cache
+    opener = xr.open_dataset
+    budget_mb = DEFAULT_BUDGET_MB if budget_mb is None else budget_mb
+    _cache = DatasetCache(int(budget_mb * 2 ** 20),
+                          opener=functools.partial(zarr_cache.open_dataset,
+                                                   netcdf_opener=opener))
+
+    def cached_open_dataset(filename_or_obj, *args, **kwargs):
+        if args or not isinstance(filename_or_obj, (str, os.PathLike)) or \
+                not os.path.isfile(filename_or_obj):
+            return opener(filename_or_obj, *args, **kwargs)
+        return _cache.open_dataset(filename_or_obj, **kwargs)
+
+    cached_open_dataset.__doc__ = opener.__doc__
+    cached_open_dataset.__wrapped__ = opener
+    cached_open_dataset._dataset_cache = _cache
+    xr.open_dataset = cached_open_dataset
+    return _cache
+
+
+###############################################################################
+# Subset loading
+
+def _interval_indexer(values, lower, upper):
+    """Return the slice of the points of a monotonic 1-D coordinate within
+    [lower, upper], widened by one point at each end (so that contours and
+    vectors reach the edges of the map)."""
+    inside = np.nonzero((values >= lower) & (values <= upper))[0]
+    if inside.size == 0:
+        raise ValueError('no points between %s and %s' % (lower, upper))
+    return slice(max(inside[0] - 1, 0), min(inside[-1] + 2, values.size))
+
+
+def _longitude_indexer(values, lower, upper):
+    """
+    Return the indexer of the longitudes within [lower, upper] (widened by
+    one point at each end) and whether the selection wraps around the
+    periodic boundary of a global grid.
+    """
+    step = np.abs(np.diff(values)).min() if values.size > 1 else 360.
+    if values.max() - values.min() + step < 360. - 1e-6:
+        # Regional grid: match the extent to the longitude convention of
+        # the data (e.g. -100 vs 260) and select an interval
+        shifts = (-360., 0., 360.)
+        counts = [np.count_nonzero((values >= lower + shift) &
+                                   (values <= upper + shift))
+                  for shift in shifts]
+        shift = shifts[int(np.argmax(counts))]
+        return _interval_indexer(values, lower + shift, upper + shift), False
+
+    # Global grid: walk from the lower edge of the extent, eastwards
+    width = upper - lower
+    if width >= 360. - step:
+        return slice(None), False
+    offset = (values - lower) % 360.
+    order = np.argsort(offset, kind='stable')
+    inside = order[offset[order] <= width % 360.]
+    if inside.size == 0:
+        raise ValueError('no longitudes between %s and %s' % (lower, upper))
+    first = order[-1]  # the last point west of the extent
+    beyond = order[offset[order] > width % 360.][:1]
+    indices = np.concatenate([[first], inside, beyond])
+    if np.all(np.diff(indices) == 1):
+        return slice(indices[0], indices[-1] + 1), False
+    return indices, True
+
+
+def open_subset(path, variables=None, isel=None, sel=None, extent=None,
+                chunks=None, lon='lon', lat='lat', **kwargs):
+    """
+    Open only the part of a file that a plot needs.
+
+    The selections are applied to the lazily opened dataset before any data
+    is read, so only the selected hyperslab is read from disk: without
+    ``chunks``, xarray passes the (possibly strided) slices straight to the
+    netCDF (or Zarr) reader and the full variable is never materialized.
+    The file is opened through the process-wide cache when it is installed
+    (see ``install``), so examples reading the same file share its decoded
+    lazy dataset.
+
+    Parameters
+    ----------
+    path : str
+        The file to open.
+    variables : list of str, optional
+        The data variables to keep (the others are never read).
+    isel, sel : dict, optional
+        Positional and label-based selections, as in ``Dataset.isel`` and
+        ``Dataset.sel`` (e.g. ``isel=dict(time=0, lon=slice(0, -1, 5))``).
+    extent : sequence of 4 floats, optional
+        ``[lon_min, lon_max, lat_min, lat_max]``, as passed to
+        ``GeoAxes.set_extent``.  Only the grid points within it (plus one
+        point beyond each edge) are read.  Longitudes may use either the
+        -180/180 or the 0/360 convention; on a global grid, an extent across
+        the periodic boundary returns continuous longitudes (e.g. 330 to
+        390).
+    chunks : int or dict, optional
+        Return a lazy dask-backed subset with these chunks instead of loading
+        it into memory.
+    lon, lat : str
+        Names of the longitude and latitude dimensions.
+    **kwargs
+        Passed on to ``xarray.open_dataset``.
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    if _cache is not None:
+        ds = _cache.open_dataset(path, **kwargs)
+    else:
+        ds = zarr_cache.open_dataset(path, **kwargs)
+    if variables is not None:
+        ds = ds[list(variables)]
+    if isel:
+        ds = ds.isel(isel)
+    if sel:
+        ds = ds.sel(sel)
+    if extent is not None:
+        lon_min, lon_max, lat_min, lat_max = extent
+        lon_values = ds[lon].values
+        lon_indexer, wrapped = _longitude_indexer(lon_values, lon_min, lon_max)
+        lat_indexer = _interval_indexer(ds[lat].values, min(lat_min, lat_max),
+                                        max(lat_min, lat_max))
+        ds = ds.isel({lon: lon_indexer, lat: lat_indexer})
+        if wrapped:
+            ds = ds.assign_coords({lon: np.rad2deg(np.unwrap(
+                np.deg2rad(ds[lon].values)))})
+    if chunks is not None:
+        return ds.chunk(chunks)
+    return ds.load()
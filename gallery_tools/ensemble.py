@@ -0,0 +1,200 @@
+"""
+ensemble.py
+===========
+Open the member files of an ensemble as one dataset, stacked along a new
+dimension (``case`` in the examples), with a disk cache of the result.
+
+``xarray.open_mfdataset(files, concat_dim='case', combine='nested',
+preprocess=...)`` opens and decodes the members one after the other on every
+run.  ``open_ensemble`` opens them concurrently in a thread pool, from their
+Zarr copies when there are some (see ``gallery_tools.zarr_cache``), applies
+the ``preprocess`` function, stacks them, and writes the decoded result to a
+Zarr store.  As HDF5 is not thread-safe, netCDF members are opened one at a
+time and their reads are serialized, so only their decoding and
+preprocessing run concurrently; Zarr members are read concurrently too.
+The next call with the same members returns the store, chunked one member
+at a time, without opening or decoding any member.
+
+The store is keyed by the member paths; it is rewritten when the content of
+any member, the opening arguments or the source of the ``preprocess``
+function change.
+
+``install`` routes ``xarray.open_mfdataset`` calls that stack a list of files
+along a new dimension through ``open_ensemble``, which is how the batch
+renderer and the parallel gallery workers use it without changing the
+examples.
+"""
+
+import contextlib
+import glob
+import hashlib
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import xarray as xr
+
+from gallery_tools import zarr_cache
+from gallery_tools.data import _freeze
+from gallery_tools.fingerprint import (atomic_write, file_digest, load_digests,
+                                       save_digests)
+from gallery_tools.runner import REPO_DIR
+
+# Directory of the stacked ensemble stores
+DEFAULT_CACHE_DIR = os.environ.get(
+    'GALLERY_ENSEMBLE_DIR', os.path.join(REPO_DIR, '_build', 'ensemble_cache'))
+
+# Encoding attributes of the decoded variables that are kept when writing the
+# store (the netCDF storage settings do not apply to Zarr)
+_KEPT_ENCODING = ('units', 'calendar', 'dtype', '_FillValue', 'scale_factor',
+                  'add_offset')
+
+# Serializes the opening of netCDF members (see _open_member)
+_netcdf_lock = threading.Lock()
+
+# open_mfdataset arguments that control how the members are combined; calls
+# using them go straight to xarray
+_COMBINE_ARGS = ('compat', 'data_vars', 'coords', 'join', 'attrs_file',
+                 'combine_attrs', 'parallel')
+
+
+def _function_source(func):
+    """Return the source (or, failing that, the bytecode) of a function."""
+    if func is None:
+        return None
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        code = getattr(func, '__code__', None)
+        return code.co_code.hex() if code is not None else repr(func)
+
+
+def _open_member(path, preprocess, kwargs):
+    # The HDF5 library under netCDF4 is not thread-safe: members without a
+    # Zarr copy are opened and closed one at a time.  Their reads go through
+    # xarray's own netCDF lock, while the decoding and preprocessing of the
+    # members overlap
+    lock = _netcdf_lock if kwargs.get('engine') is not None or \
+        zarr_cache.find_store(path) is None else contextlib.nullcontext()
+    with lock:
+        ds = zarr_cache.open_dataset(path, **kwargs)
+    try:
+        member = ds if preprocess is None else preprocess(ds)
+        return member.load()
+    finally:
+        with lock:
+            ds.close()
+
+
+def stack_members(files, dim='case', preprocess=None, jobs=None, **kwargs):
+    """
+    Open, preprocess and load the member files concurrently, and stack them
+    along ``dim`` as ``open_mfdataset(..., combine='nested')`` does.
+    """
+    with ThreadPoolExecutor(max_workers=jobs or min(len(files), 8)) as pool:
+        members = list(pool.map(lambda path: _open_member(path, preprocess,
+                                                          kwargs), files))
+    return xr.combine_nested(members, concat_dim=dim)
+
+
+def open_ensemble(files, dim='case', preprocess=None, cache_dir=None,
+                  jobs=None, **kwargs):
+    """
+    Open an ensemble of files as one dataset stacked along ``dim``.
+
+    Parameters
+    ----------
+    files : list of str
+        The member files, in ensemble order.
+    dim : str
+        The new dimension spanning the members.
+    preprocess : callable, optional
+        Applied to the dataset of each member, as in ``open_mfdataset``.
+    cache_dir : str, optional
+        Directory of the stacked stores (``DEFAULT_CACHE_DIR`` by default).
+        An empty string disables the cache.
+    jobs : int, optional
+        Number of members opened concurrently (up to 8 by default).
+    **kwargs
+        Passed on to ``xarray.open_dataset`` for each member.
+
+    Returns
+    -------
+    xarray.Dataset
+        A lazy dataset chunked one member at a time, read from the cache (or
+        the stacked members, loaded in memory, when the cache is disabled).
+    """
+    files = [os.path.realpath(path) for path in files]
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    if not cache_dir:
+        return stack_members(files, dim, preprocess, jobs, **kwargs)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    name = hashlib.blake2b('\n'.join(files).encode(),
+                           digest_size=8).hexdigest()
+    store = os.path.join(cache_dir, '%s-%s.zarr' % (dim, name))
+    digests = load_digests(cache_dir)
+    key = hashlib.blake2b(repr((
+        [file_digest(path, digests) for path in files], dim,
+        _freeze(kwargs), _function_source(preprocess),
+        xr.__version__)).encode(), digest_size=16).hexdigest()
+    save_digests(cache_dir, digests)
+
+    if os.path.exists(store + '.key'):
+        with open(store + '.key') as fid:
+            if fid.read() == key:
+                return xr.open_dataset(store, engine='zarr', consolidated=True,
+                                       chunks={dim: 1})
+
+    ds = stack_members(files, dim, preprocess, jobs, **kwargs)
+    for variable in ds.variables.values():
+        variable.encoding = {attr: value
+                             for attr, value in variable.encoding.items()
+                             if attr in _KEPT_ENCODING}
+    # The store is written under a temporary name and renamed, then its key,
+    # so that concurrent readers never open a partial store
+    with atomic_write(store, None) as tmp:
+        ds.chunk({dim: 1}).to_zarr(tmp, mode='w', consolidated=True)
+    with atomic_write(store + '.key', 'w') as fid:
+        fid.write(key)
+    return xr.open_dataset(store, engine='zarr', consolidated=True,
+                           chunks={dim: 1})
+
+
+def install(cache_dir=None):
+    """
+    Route ``xarray.open_mfdataset`` calls that stack a list of files along a
+    new dimension (``combine='nested'`` with a single ``concat_dim`` name)
+    through ``open_ensemble``.  Other calls go straight to xarray.
+    """
+    if getattr(xr.open_mfdataset, '_ensemble_cache', False):
+        return
+    opener = xr.open_mfdataset
+
+    def cached_open_mfdataset(paths, **kwargs):
+        # Only the arguments of the call are passed on to xarray, whose
+        # defaults differ between versions
+        concat_dim = kwargs.get('concat_dim')
+        if kwargs.get('combine') != 'nested' or \
+                not isinstance(concat_dim, str) or \
+                kwargs.get('chunks') is not None or \
+                any(arg in kwargs for arg in _COMBINE_ARGS):
+            return opener(paths, **kwargs)
+        if isinstance(paths, str) and glob.has_magic(paths):
+            paths = sorted(glob.glob(paths))
+        if not isinstance(paths, (list, tuple)) or \
+                not all(isinstance(path, (str, os.PathLike)) and
+                        os.path.isfile(path) for path in paths):
+            return opener(paths, **kwargs)
+        kwargs = {name: value for name, value in kwargs.items()
+                  if name not in ('concat_dim', 'combine', 'chunks')}
+        preprocess = kwargs.pop('preprocess', None)
+        return open_ensemble(paths, concat_dim, preprocess, cache_dir,
+                             **kwargs)
+
+    cached_open_mfdataset.__doc__ = opener.__doc__
+    cached_open_mfdataset.__wrapped__ = opener
+    cached_open_mfdataset._ensemble_cache = True
+    xr.open_mfdataset = cached_open_mfdataset
@@ -0,0 +1,128 @@
+"""
+examples.py
+===========
+Locate the gallery example scripts the same way sphinx-gallery does.
+
+The gallery tools call private functions of sphinx-gallery and rely on the
+values its functions return, which change between releases: they only run
+with the versions in ``SUPPORTED_VERSIONS`` (see ``is_supported``), and the
+build falls back to plain sphinx-gallery with any other version.
+"""
+
+import os
+import re
+
+import sphinx_gallery
+from sphinx_gallery.utils import get_md5sum
+
+try:
+    from sphinx_gallery.gen_gallery import (_complete_gallery_conf,
+                                            get_subsections)
+except ImportError:
+    _complete_gallery_conf = get_subsections = None
+
+# sphinx-gallery releases the gallery tools work with (pinned in the conda
+# environments)
+SUPPORTED_VERSIONS = ('0.7.',)
+
+
+def is_supported():
+    """Return True if the installed sphinx-gallery is one of the
+    ``SUPPORTED_VERSIONS``."""
+    return sphinx_gallery.__version__.startswith(SUPPORTED_VERSIONS) and \
+        _complete_gallery_conf is not None
+
+
+def complete_conf(app):
+    """
+    Return the completed sphinx-gallery configuration of a Sphinx build,
+    as sphinx-gallery will compute it, without registering its css files
+    a second time.
+    """
+    try:
+        plot_gallery = eval(app.builder.config.plot_gallery)
+    except TypeError:
+        plot_gallery = bool(app.builder.config.plot_gallery)
+    gallery_conf = _complete_gallery_conf(
+        app.config.sphinx_gallery_conf, app.builder.srcdir, plot_gallery,
+        app.builder.config.abort_on_example_error,
+        app.builder.config.highlight_language, app.builder.name)
+    # Needed to look up the subsection READMEs
+    gallery_conf['app'] = app
+    return gallery_conf
+
+
+def executing_example(gallery_conf, fname):
+    """
+    Return the path of the example ``fname`` that sphinx-gallery is about
+    to execute, from a module resetter (which is only given the file name).
+
+    ``generate_file_rst`` records the title of each example under its path
+    just before executing it; the last example recorded with this file name
+    is the one being executed.
+    """
+    for src_file in reversed(list(gallery_conf.get('titles', {}))):
+        if os.path.basename(src_file) == fname:
+            return src_file
+    return os.path.join(gallery_conf['src_dir'], fname)
+
+
+def _list_dir(src_dir, gallery_conf):
+    """Return the example file names of one gallery (sub)directory, sorted
+    with the configured ``within_subsection_order``."""
+    fnames = [fname for fname in os.listdir(src_dir)
+              if fname.endswith('.py') and
+              re.search(gallery_conf['ignore_pattern'],
+                        os.path.normpath(os.path.join(src_dir, fname))) is None]
+    return sorted(fnames,
+                  key=gallery_conf['within_subsection_order'](src_dir))
+
+
+def collect_examples(gallery_conf):
+    """
+    List every example script of the gallery in build order.
+
+    Parameters
+    ----------
+    gallery_conf : dict
+        A completed sphinx-gallery configuration (``src_dir``,
+        ``examples_dirs`` and ``gallery_dirs`` must be set).
+
+    Returns
+    -------
+    list of (str, str, str)
+        ``(src_dir, target_dir, fname)`` tuples, in the order sphinx-gallery
+        visits the examples: top-level scripts first, then each subsection.
+    """
+    srcdir = gallery_conf['src_dir']
+    examples_dirs = gallery_conf['examples_dirs']
+    gallery_dirs = gallery_conf['gallery_dirs']
+    if not isinstance(examples_dirs, list):
+        examples_dirs = [examples_dirs]
+    if not isinstance(gallery_dirs, list):
+        gallery_dirs = [gallery_dirs]
+
+    examples = []
+    for examples_dir, gallery_dir in zip(examples_dirs, gallery_dirs):
+        examples_dir = os.path.join(srcdir, examples_dir)
+        gallery_dir = os.path.join(srcdir, gallery_dir)
+        dirs = [(examples_dir, gallery_dir)]
+        dirs += [(os.path.join(examples_dir, subsection),
+                  os.path.join(gallery_dir, subsection))
+                 for subsection in get_subsections(srcdir, examples_dir,
+                                                   gallery_conf)]
+        for src_dir, target_dir in dirs:
+            examples += [(src_dir, target_dir, fname)
+                         for fname in _list_dir(src_dir, gallery_conf)]
+    return examples
+
+
+def is_current(src_dir, target_dir, fname):
+    """Return True if the gallery output of an example matches its source,
+    i.e. sphinx-gallery will not execute it again."""
+    md5_file = os.path.join(target_dir, fname) + '.md5'
+    if not os.path.exists(md5_file):
+        return False
+    with open(md5_file, 'r') as fid:
+        ref_md5 = fid.read()
+    return get_md5sum(os.path.join(src_dir, fname)) == ref_md5
@@ -0,0 +1,407 @@
+"""
+features.py
+===========
+Map features that only hand the visible part of their geometries to cartopy.
+
+cartopy draws a ``ShapelyFeature`` by projecting *every* one of its
+geometries, whatever the extent of the map, and tests the geometries of the
+other features against the extent one by one.  ``ClippedFeature`` keeps its
+geometries in an STR-tree: when the map is drawn, only the geometries whose
+bounding boxes intersect the extent of the axes (plus a margin) are looked
+up, and they are clipped to that box before cartopy projects them.  A
+regional map then projects a handful of small geometries instead of, say,
+every country of the world at 10m resolution.
+
+``LODFeature`` also adapts the level of detail of a feature to the size of a
+pixel of the map: Natural Earth features are read at the coarsest scale that
+shows every detail, and the geometries are simplified to a fraction of a
+pixel.
+
+``LODFeature`` also keeps the geometries it draws, projected and clipped, in
+an on-disk cache keyed by the feature (and scale), the target projection,
+the extent of the map and the versions of the libraries that project it
+(``fingerprint.library_versions``): a map layout drawn again, by a later
+build or another worker, loads its projected features instead of reading,
+clipping and projecting them.
+
+``install`` wraps the features added with ``GeoAxes.add_feature`` in an
+``LODFeature``, which is how the batch renderer and the parallel gallery
+workers use it without changing the examples.
+"""
+
+import hashlib
+import os
+
+import cartopy.feature as cfeature
+import numpy as np
+from shapely.errors import GEOSException
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+from shapely.strtree import STRtree
+
+from gallery_tools.fingerprint import atomic_write, library_versions
+from gallery_tools.geostore import _from_wkb
+from gallery_tools.runner import REPO_DIR
+
+# Margin added on each side of the extent, as a fraction of its size (so
+# that the edges created by the clipping are outside the map)
+DEFAULT_MARGIN = 0.05
+
+# Directory of the projected features (an empty string disables the cache)
+DEFAULT_CACHE_DIR = os.environ.get(
+    'GALLERY_FEATURE_DIR', os.path.join(REPO_DIR, '_build', 'feature_cache'))
+
+
+def _clip(geom, region):
+    """Return the part of ``geom`` inside ``region``, or ``geom`` itself if
+    GEOS cannot intersect it (e.g. an invalid, self-intersecting ring): such
+    a geometry is drawn unclipped rather than dropped."""
+    try:
+        return geom.intersection(region)
+    except GEOSException:
+        return geom
+
+
+class ClippedFeature(cfeature.Feature):
+    """
+    A feature drawn from the geometries within the extent of the map only,
+    clipped to it.
+
+    Parameters
+    ----------
+    geometries : iterable of shapely geometries, or callable
+        The geometries, or a function returning them (called when the
+        feature is first drawn).
+    crs : cartopy.crs.CRS
+        The coordinate system of the geometries.
+    margin : float
+        Margin added around the extent, as a fraction of its size.
+    key : optional
+        A (repr-able) key identifying the geometries in the projected-feature
+        cache.  By default, the key is a hash of the geometries.
+    **kwargs
+        Drawing style, as for ``cartopy.feature.ShapelyFeature``.
+    """
+
+    def __init__(self, geometries, crs, margin=DEFAULT_MARGIN, key=None,
+                 **kwargs):
+        super(ClippedFeature, self).__init__(crs, **kwargs)
+        self._source = geometries
+        self._key = key
+        self._geometries = None
+        self._tree = None
+        self.margin = margin
+        # Clipped geometries, by extent: redrawing the same map returns the
+        # same geometry objects, whose projected paths cartopy caches
+        self._clipped = {}
+        self._simplified = {}
+
+    @classmethod
+    def from_feature(cls, feature, margin=DEFAULT_MARGIN, key=None):
+        """Wrap another cartopy feature (read when first drawn)."""
+        return cls(feature.geometries, feature.crs, margin, key,
+                   **feature.kwargs)
+
+    def key(self):
+        """Return the key of the geometries in the projected-feature cache."""
+        if self._key is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for geom in self.geometries():
+                digest.update(geom.wkb)
+            self._key = digest.hexdigest()
+        return self._key
+
+    def geometries(self):
+        if self._geometries is None:
+            source = self._source() if callable(self._source) else \
+                self._source
+            self._geometries = [geom for geom in source
+                                if geom is not None and not geom.is_empty]
+        return iter(self._geometries)
+
+    def _candidates(self, region):
+        """Return the geometries whose bounding boxes intersect ``region``,
+        in their original order."""
+        geometries = list(self.geometries())
+        if not geometries:
+            return []
+        if self._tree is None:
+            self._tree = STRtree(geometries)
+        found = self._tree.query(region)
+        if len(found) and isinstance(found[0], BaseGeometry):
+            # shapely < 2 returns the geometries themselves
+            order = {id(geom): i for i, geom in enumerate(geometries)}
+            found = [order[id(geom)] for geom in found]
+        return [geometries[i] for i in np.sort(np.asarray(found, dtype=int))]
+
+    def intersecting_geometries(self, extent):
+        """
+        Return the geometries intersecting ``extent`` (``[x0, x1, y0, y1]``
+        in the CRS of the feature) plus its margin, clipped to it, or every
+        geometry if ``extent`` is None.
+        """
+        if extent is None or np.isnan(extent[0]):
+            return self.geometries()
+        key = tuple(extent)
+        if key not in self._clipped:
+            x0, x1, y0, y1 = extent
+            dx = (x1 - x0) * self.margin
+            dy = (y1 - y0) * self.margin
+            region = box(x0 - dx, y0 - dy, x1 + dx, y1 + dy)
+            clipped = []
+            for geom in self._candidates(region):
+                if not region.contains(geom):
+                    geom = _clip(geom, region)
+                if not geom.is_empty:
+                    clipped.append(geom)
+            self._clipped[key] = clipped
+        return iter(self._clipped[key])
+
+    def simplified_geometries(self, extent, tolerance):
+        """
+        Return ``intersecting_geometries(extent)`` simplified to
+        ``tolerance`` (in the units of the CRS of the feature), keeping
+        their topology.
+        """
+        key = (None if extent is None else tuple(extent), tolerance)
+        if key not in self._simplified:
+            self._simplified[key] = [
+                geom.simplify(tolerance, preserve_topology=True)
+                for geom in self.intersecting_geometries(extent)]
+        return iter(self._simplified[key])
+
+
+###############################################################################
+# Level of detail
+
+# Coarsest Natural Earth scale usable at a map resolution, in degrees per
+# pixel: the scales are 1:110M, 1:50M and 1:10M, i.e. about 0.28, 0.125 and
+# 0.025 degrees for a 0.28 mm pixel
+NATURAL_EARTH_SCALES = (('110m', 0.28), ('50m', 0.125), ('10m', 0.))
+
+# Simplification tolerance, in output pixels
+DEFAULT_PIXEL_TOLERANCE = 0.5
+
+# Clipped Natural Earth features, by (category, name, scale), shared by the
+# features of every map drawn in the process
+_natural_earth = {}
+
+# Projected geometries, by cache key: redrawing a map returns the same
+# geometry objects, whose paths cartopy caches
+_projected = {}
+
+
+def natural_earth_scale(degrees_per_pixel, finest='10m'):
+    """Return the coarsest Natural Earth scale that shows every detail at a
+    map resolution, but no finer than ``finest``."""
+    for scale, resolution in NATURAL_EARTH_SCALES:
+        if degrees_per_pixel >= resolution or scale == finest:
+            return scale
+
+
+class LODFeature(cfeature.Feature):
+    """
+    A feature drawn with the level of detail of the map it is drawn on.
+
+    When the map is drawn, the size of a pixel follows from the extent of
+    the axes and their size in pixels (i.e., the figure size and DPI).  A
+    Natural Earth feature is read at the coarsest scale that shows every
+    detail at that size (but no finer than its own scale), and the
+    geometries within the extent are simplified to ``pixel_tolerance``
+    pixels.  Both the geometries and their simplified versions are cached
+    (see ``ClippedFeature``), so the cost of drawing a feature depends on
+    the size of the image rather than on the resolution of the data.
+
+    Parameters
+    ----------
+    feature : cartopy.feature.Feature
+        The feature to draw.
+    axes : cartopy.mpl.geoaxes.GeoAxes
+        The axes the feature is drawn on.
+    pixel_tolerance : float, optional
+        Simplification tolerance, in pixels (None to not simplify).
+    margin : float
+        Margin added around the extent, as a fraction of its size.
+    cache_dir : str, optional
+        Directory of the projected-feature cache (``DEFAULT_CACHE_DIR`` by
+        default; an empty string disables it).
+    """
+
+    def __init__(self, feature, axes, pixel_tolerance=DEFAULT_PIXEL_TOLERANCE,
+                 margin=DEFAULT_MARGIN, cache_dir=None):
+        super(LODFeature, self).__init__(feature.crs, **feature.kwargs)
+        self.feature = feature
+        self.axes = axes
+        self.pixel_tolerance = pixel_tolerance
+        self.margin = margin
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        self._clipped = None
+
+    @property
+    def crs(self):
+        # With the projected-feature cache, cartopy is handed geometries
+        # already in the projection of the axes
+        if self.cache_dir:
+            return self.axes.projection
+        return self._crs
+
+    def _source(self, scale=None):
+        """Return the ``ClippedFeature`` of the feature (at ``scale``, for a
+        Natural Earth feature)."""
+        feature = self.feature
+        if isinstance(feature, cfeature.NaturalEarthFeature):
+            scale = scale or feature.scale
+            key = ('natural_earth', feature.category, feature.name, scale)
+            if key not in _natural_earth:
+                _natural_earth[key] = ClippedFeature.from_feature(
+                    cfeature.NaturalEarthFeature(feature.category,
+                                                 feature.name, scale),
+                    self.margin, key=key)
+            return _natural_earth[key]
+        if self._clipped is None:
+            self._clipped = ClippedFeature.from_feature(feature, self.margin)
+        return self._clipped
+
+    def _finest_scale(self):
+        scaler = self.feature.scaler
+        # An adaptive scale may go down to the finest Natural Earth scale
+        return scaler.scale if type(scaler) is cfeature.Scaler else '10m'
+
+    def _level(self, extent):
+        """Return the ``ClippedFeature`` and the simplification tolerance
+        (or None) used to draw ``extent`` (in the CRS of the feature)."""
+        if extent is None or np.isnan(extent[0]):
+            return self._source(), None
+        x0, x1, y0, y1 = extent
+        width, height = self.axes.bbox.width, self.axes.bbox.height
+        if width <= 0 or height <= 0:
+            return self._source(), None
+        per_pixel = max((x1 - x0) / width, (y1 - y0) / height)
+        scale = None
+        if isinstance(self.feature, cfeature.NaturalEarthFeature):
+            scale = natural_earth_scale(per_pixel, self._finest_scale())
+        if not self.pixel_tolerance:
+            return self._source(scale), None
+        # Round the tolerance down to a power of 2, so that maps of similar
+        # sizes share their simplified geometries
+        tolerance = float(2 ** np.floor(np.log2(per_pixel *
+                                                self.pixel_tolerance)))
+        return self._source(scale), tolerance
+
+    def _visible_geometries(self, extent):
+        """Return the geometries drawn at ``extent``, in the CRS of the
+        feature."""
+        source, tolerance = self._level(extent)
+        if extent is None or np.isnan(extent[0]):
+            return source.geometries()
+        if tolerance is None:
+            return source.intersecting_geometries(extent)
+        return source.simplified_geometries(extent, tolerance)
+
+    def _projected_geometries(self):
+        """Return the geometries drawn on the axes, projected, from the
+        projected-feature cache if they are in it."""
+        try:
+            extent = self.axes.get_extent(self._crs)
+        except ValueError:
+            extent = None
+        source, tolerance = self._level(extent)
+        projection = self.axes.projection
+        key = hashlib.blake2b(repr((
+            source.key(), tolerance, self.margin,
+            None if extent is None else np.round(extent, 6).tolist(),
+            _crs_key(self._crs), _crs_key(projection),
+            sorted(library_versions().items()))).encode(),
+            digest_size=16).hexdigest()
+        if key not in _projected:
+            fname = os.path.join(self.cache_dir, key + '.npz')
+            if os.path.exists(fname):
+                geometries = _load_geometries(fname)
+            else:
+                geometries = []
+                for geom in self._visible_geometries(extent):
+                    geom = projection.project_geometry(geom, self._crs)
+                    if not geom.is_empty:
+                        geometries.append(geom)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                _save_geometries(fname, geometries)
+            _projected[key] = geometries
+        return iter(_projected[key])
+
+    def geometries(self):
+        if self.cache_dir:
+            return self._projected_geometries()
+        return self._source().geometries()
+
+    def intersecting_geometries(self, extent):
+        if self.cache_dir:
+            # The extent is in the projection of the axes: the cache works
+            # out the extent in the CRS of the feature itself
+            return self._projected_geometries()
+        return self._visible_geometries(extent)
+
+
+def _crs_key(crs):
+    """Return a string identifying a coordinate system."""
+    definition = getattr(crs, 'proj4_init', None) or crs.to_wkt()
+    return '%s:%s' % (type(crs).__name__, definition)
+
+
+def _save_geometries(fname, geometries):
+    """Save geometries as their concatenated WKB and its offsets."""
+    blobs = [geom.wkb for geom in geometries]
+    offsets = np.cumsum([0] + [len(blob) for blob in blobs])
+    data = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+    with atomic_write(fname) as fid:
+        np.savez(fid, data=data, offsets=offsets)
+
+
+def _load_geometries(fname):
+    with np.load(fname) as saved:
+        data, offsets = saved['data'].tobytes(), saved['offsets']
+    return _from_wkb([data[start:end]
+                      for start, end in zip(offsets[:-1], offsets[1:])])
+
+
+def _clippable(feature, kwargs):
+    """Whether a feature added with ``kwargs`` can be wrapped."""
+    if isinstance(feature, (ClippedFeature, LODFeature)):
+        return False
+    if {'array', 'styler'} & (set(kwargs) | set(feature.kwargs)):
+        return False
+    # Features other than Natural Earth's with an adaptive scale (e.g.
+    # GSHHS) choose their geometries from the extent
+    scaler = getattr(feature, 'scaler', None)
+    return scaler is None or type(scaler) is cfeature.Scaler or \
+        isinstance(feature, cfeature.NaturalEarthFeature)
+
+
+def install(margin=DEFAULT_MARGIN, pixel_tolerance=DEFAULT_PIXEL_TOLERANCE,
+            cache_dir=None):
+    """
+    Make ``GeoAxes.add_feature`` wrap its features in an ``LODFeature``
+    (which draws the geometries within the extent of the map only, at the
+    level of detail of the map, from the projected-feature cache in
+    ``cache_dir``).
+
+    Features drawn with per-geometry colours (an ``array`` or a ``styler``)
+    are left as they are, since cartopy keeps those consistent by drawing
+    every geometry, and so are features that choose their own scale (other
+    than Natural Earth's).
+    """
+    from cartopy.mpl.geoaxes import GeoAxes
+
+    if getattr(GeoAxes.add_feature, '_clipped_features', False):
+        return
+    add_feature = GeoAxes.add_feature
+
+    def clipped_add_feature(self, feature, **kwargs):
+        if _clippable(feature, kwargs):
+            feature = LODFeature(feature, self, pixel_tolerance, margin,
+                                 cache_dir)
+        return add_feature(self, feature, **kwargs)
+
+    clipped_add_feature.__doc__ = add_feature.__doc__
+    clipped_add_feature.__wrapped__ = add_feature
+    clipped_add_feature._clipped_features = True
+    GeoAxes.add_feature = clipped_add_feature
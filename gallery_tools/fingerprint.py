@@ -0,0 +1,176 @@
+"""
+fingerprint.py
+==============
+Content fingerprints used to invalidate the caches of the gallery tools,
+and the helpers the caches share to name and write their files.
+"""
+
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Distributions whose versions are part of every cache key
+TRACKED_PACKAGES = ('numpy', 'pandas', 'xarray', 'netCDF4', 'matplotlib',
+                    'contourpy', 'Cartopy', 'shapely', 'pyproj', 'cmaps',
+                    'geocat-viz', 'geocat-comp', 'sphinx-gallery')
+
+
+@functools.lru_cache(maxsize=None)
+def _library_versions():
+    from importlib.metadata import version, PackageNotFoundError
+
+    versions = []
+    for package in TRACKED_PACKAGES:
+        try:
+            versions.append((package, version(package)))
+        except PackageNotFoundError:
+            versions.append((package, None))
+    return tuple(versions)
+
+
+def library_versions():
+    """Return a ``{distribution: version}`` dict for ``TRACKED_PACKAGES``
+    (looked up once per process)."""
+    return dict(_library_versions())
+
+
+def file_digest(path, digests=None):
+    """
+    Return the blake2b content hash of a file.
+
+    Parameters
+    ----------
+    path : str
+        The file to hash.
+    digests : dict, optional
+        ``{path: [size, mtime_ns, digest]}`` entries from earlier builds.
+        A file whose size and modification time match its entry is not read
+        again.  The dict is updated in place.
+    """
+    stat = os.stat(path)
+    if digests is not None:
+        entry = digests.get(path)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+    blake = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fid:
+        for block in iter(lambda: fid.read(1 << 20), b''):
+            blake.update(block)
+    digest = blake.hexdigest()
+    if digests is not None:
+        digests[path] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+
+def load_digests(cache_dir):
+    """Return the ``file_digest`` entries saved in a cache directory."""
+    path = os.path.join(cache_dir, 'digests.json')
+    if os.path.exists(path):
+        with open(path) as fid:
+            return json.load(fid)
+    return {}
+
+
+def save_digests(cache_dir, digests):
+    """Save ``file_digest`` entries in a cache directory (atomically, as
+    parallel workers share the directory)."""
+    with atomic_write(os.path.join(cache_dir, 'digests.json'), 'w') as fid:
+        json.dump(digests, fid)
+
+
+def source_info(path):
+    """Return the size, modification time and content hash of a file, as
+    recorded next to the caches derived from it."""
+    stat = os.stat(path)
+    return {'source': os.path.realpath(path), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'digest': file_digest(path)}
+
+
+def source_matches(path, info):
+    """
+    Return whether a file still matches its ``source_info`` record.
+
+    A file with a new modification time (e.g. checked out again) but the same
+    content matches; its record is updated in place with the new time.
+    """
+    stat = os.stat(path)
+    if info['size'] != stat.st_size:
+        return False
+    if info['mtime_ns'] != stat.st_mtime_ns:
+        if file_digest(path) != info['digest']:
+            return False
+        info['mtime_ns'] = stat.st_mtime_ns
+    return True
+
+
+def array_digest(digest, values):
+    """Update a ``hashlib`` digest with the dtype, shape, values and mask
+    (of a masked array) of an array."""
+    data = np.ascontiguousarray(np.ma.getdata(values))
+    digest.update(repr((data.dtype.str, data.shape)).encode())
+    digest.update(data.tobytes())
+    if np.ma.is_masked(values):
+        digest.update(np.ascontiguousarray(np.ma.getmaskarray(values)).data)
+
+
+def keyed_path(path, directory, extension=''):
+    """
+    Return the path of a file derived from ``path`` in a cache directory:
+    ``<directory>/<name>-<key><extension>``, where ``name`` is the base
+    name of ``path`` without extension and ``key`` a hash of its real path
+    (files of the same name in different directories get different keys).
+    """
+    path = os.path.realpath(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    key = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+    return os.path.join(directory, '%s-%s%s' % (name, key, extension))
+
+
+@contextlib.contextmanager
+def atomic_write(fname, mode='wb'):
+    """
+    Write ``fname`` under a temporary name, renamed to ``fname`` once it is
+    complete, so that concurrent readers (parallel workers) never see a
+    partial file.
+
+    Yields the temporary file opened with ``mode``, or with ``mode=None``
+    its path, for writers that open the file themselves (SQLite, netCDF,
+    Zarr stores).  The temporary file is removed if writing fails.
+
+    A directory (e.g. a Zarr store) replaces the previous one in two
+    renames, as ``os.replace`` cannot replace a directory that is not
+    empty; if another process renamed an equivalent directory into place
+    in between, that one is kept.
+    """
+    tmp = '%s.%d.tmp' % (fname, os.getpid())
+    _remove(tmp)
+    try:
+        if mode is None:
+            yield tmp
+        else:
+            with open(tmp, mode) as fid:
+                yield fid
+        if os.path.isdir(tmp) and os.path.isdir(fname):
+            old = '%s.%d.old' % (fname, os.getpid())
+            try:
+                os.replace(fname, old)
+                os.replace(tmp, fname)
+            except OSError:
+                pass
+            _remove(old)
+        else:
+            os.replace(tmp, fname)
+    finally:
+        _remove(tmp)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,342 @@
+"""
+geostore.py
+===========
+An offline store of shapefile geometries, with indexed attributes.
+
+Reading a shapefile with ``cartopy.io.shapereader.Reader`` parses every
+record in Python, and ``natural_earth`` downloads the Natural Earth files on
+first use.  ``GeometryStore`` ingests a shapefile once into an SQLite file:
+one row per record with its WKB-serialized geometry and bounding box, and an
+(attribute, value) table indexed for lookups.  A query such as "ADMIN in
+(China, Taiwan)", or "every record but those", then only reads and decodes
+the matching geometries, without touching the shapefile or the network.
+
+The stores live in ``DEFAULT_STORE_DIR``, one per shapefile.  A store is
+rebuilt when its shapefile changes; it is used as is when the shapefile is
+gone (e.g. on a machine without network access to Natural Earth).
+
+``install`` makes cartopy read shapefiles (``Reader``, the Natural Earth
+features and ``natural_earth``) from the stores, which is how the batch
+renderer and the parallel gallery workers use it without changing the
+examples.
+
+Usage::
+
+    store = natural_earth_store('10m', 'cultural', 'admin_0_countries')
+    china = store.geometries(where={'ADMIN': ['China', 'Taiwan']})
+    others = store.geometries(exclude={'ADMIN': ['China', 'Taiwan']})
+"""
+
+import json
+import os
+import sqlite3
+
+from gallery_tools.fingerprint import (atomic_write, keyed_path, source_info,
+                                       source_matches)
+from gallery_tools.runner import REPO_DIR
+
+# Directory of the geometry stores
+DEFAULT_STORE_DIR = os.environ.get(
+    'GALLERY_GEOMETRY_DIR', os.path.join(REPO_DIR, '_build', 'geometry_store'))
+
+
+def _from_wkb(blobs):
+    """Decode a list of WKB blobs into shapely geometries."""
+    try:
+        from shapely import from_wkb
+    except ImportError:
+        # shapely < 2
+        from shapely import wkb
+        return [wkb.loads(bytes(blob)) for blob in blobs]
+    return list(from_wkb([bytes(blob) for blob in blobs]))
+
+
+def _write_store(shapefile, path):
+    """Write the records of ``shapefile`` into a new SQLite file."""
+    from cartopy.io.shapereader import BasicReader
+
+    db = sqlite3.connect(path)
+    db.executescript('''
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE records (fid INTEGER PRIMARY KEY, minx REAL,
+                              miny REAL, maxx REAL, maxy REAL, wkb BLOB);
+        CREATE TABLE attributes (fid INTEGER, name TEXT, value);
+    ''')
+    reader = BasicReader(shapefile)
+    for fid, record in enumerate(reader.records()):
+        geometry = record.geometry
+        if geometry is None or geometry.is_empty:
+            bounds, wkb = (None,) * 4, None
+        else:
+            bounds, wkb = geometry.bounds, geometry.wkb
+        db.execute('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)',
+                   (fid,) + tuple(bounds) + (wkb,))
+        db.executemany('INSERT INTO attributes VALUES (?, ?, ?)',
+                       [(fid, name, value if isinstance(
+                           value, (int, float, str, type(None)))
+                         else str(value))
+                        for name, value in record.attributes.items()])
+    reader.close()
+    db.executescript('''
+        CREATE INDEX attribute_values ON attributes (name, value);
+        CREATE INDEX attribute_records ON attributes (fid);
+    ''')
+    db.execute('INSERT INTO meta VALUES (?, ?)',
+               ('source', json.dumps(source_info(shapefile))))
+    prj = os.path.splitext(shapefile)[0] + '.prj'
+    if os.path.exists(prj):
+        with open(prj) as fid:
+            db.execute('INSERT INTO meta VALUES (?, ?)', ('prj', fid.read()))
+    db.commit()
+    db.close()
+
+
+class GeometryStore(object):
+    """
+    Geometries and attributes of the records of a shapefile, in SQLite.
+
+    Parameters
+    ----------
+    path : str
+        The SQLite file of the store (see ``ingest``).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect('file:%s?mode=ro' % path, uri=True,
+                                   check_same_thread=False)
+
+    @classmethod
+    def ingest(cls, shapefile, path):
+        """Read every record of ``shapefile`` into a new store at ``path``."""
+        with atomic_write(path, None) as tmp:
+            _write_store(shapefile, tmp)
+        return cls(path)
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def _meta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?',
+                               (key,)).fetchone()
+        return None if row is None else row[0]
+
+    @property
+    def source(self):
+        """The ``source_info`` of the ingested shapefile."""
+        return json.loads(self._meta('source'))
+
+    @property
+    def prj(self):
+        """The WKT of the ``.prj`` file of the shapefile, or None."""
+        return self._meta('prj')
+
+    def close(self):
+        self._db.close()
+
+    def _select(self, where=None, exclude=None):
+        """Return the SQL condition on ``fid`` selecting the records whose
+        attributes match ``where`` and not ``exclude``, and its parameters."""
+        conditions, params = [], []
+        for clauses, operator in ((where, 'IN'), (exclude, 'NOT IN')):
+            for name, values in (clauses or {}).items():
+                if isinstance(values, (str, bytes, int, float)):
+                    values = [values]
+                values = list(values)
+                conditions.append(
+                    'fid %s (SELECT fid FROM attributes WHERE name = ? AND '
+                    'value IN (%s))' % (operator, ', '.join('?' * len(values))))
+                params += [name] + values
+        return ' AND '.join(conditions) or '1', params
+
+    def query(self, where=None, exclude=None, bbox=None):
+        """
+        Return the ids of the matching records, in shapefile order.
+
+        Parameters
+        ----------
+        where : dict, optional
+            ``{attribute: value or list of values}``: keep the records whose
+            attributes have one of the values (for every attribute given).
+        exclude : dict, optional
+            The same, for the records to leave out.
+        bbox : sequence of 4 floats, optional
+            ``(minx, miny, maxx, maxy)``: keep the records whose bounding
+            box intersects it.
+        """
+        condition, params = self._select(where, exclude)
+        if bbox is not None:
+            condition += ' AND maxx >= ? AND minx <= ? AND maxy >= ? ' \
+                         'AND miny <= ?'
+            params += [bbox[0], bbox[2], bbox[1], bbox[3]]
+        return [fid for fid, in self._db.execute(
+            'SELECT fid FROM records WHERE wkb IS NOT NULL AND %s '
+            'ORDER BY fid' % condition, params)]
+
+    def geometries(self, where=None, exclude=None, bbox=None, fids=None):
+        """Return the geometries of the matching records (see ``query``), or
+        of the records ``fids``."""
+        if fids is None:
+            fids = self.query(where, exclude, bbox)
+        blobs = {}
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(fids), 500):
+            batch = fids[start:start + 500]
+            blobs.update(self._db.execute(
+                'SELECT fid, wkb FROM records WHERE fid IN (%s)'
+                % ', '.join('?' * len(batch)), batch))
+        return _from_wkb([blobs[fid] for fid in fids])
+
+    def attributes(self, fids):
+        """Return the attribute dicts of the records ``fids``."""
+        attributes = {fid: {} for fid in fids}
+        for start in range(0, len(fids), 500):
+            batch = fids[start:start + 500]
+            for fid, name, value in self._db.execute(
+                    'SELECT fid, name, value FROM attributes WHERE fid IN '
+                    '(%s) ORDER BY rowid' % ', '.join('?' * len(batch)),
+                    batch):
+                attributes[fid][name] = value
+        return [attributes[fid] for fid in fids]
+
+    def records(self, where=None, exclude=None, bbox=None):
+        """Return the matching records as cartopy ``Record``-like objects."""
+        fids = self.query(where, exclude, bbox)
+        return [StoreRecord(geometry, attributes) for geometry, attributes in
+                zip(self.geometries(fids=fids), self.attributes(fids))]
+
+
+class StoreRecord(object):
+    """A record of a ``GeometryStore``, with the interface of cartopy's
+    shapefile ``Record``."""
+
+    def __init__(self, geometry, attributes):
+        self.geometry = geometry
+        self.attributes = attributes
+
+    @property
+    def bounds(self):
+        return self.geometry.bounds
+
+
+class StoreReader(object):
+    """A ``GeometryStore`` with the interface of cartopy's shapefile
+    ``Reader``."""
+
+    def __init__(self, store, bbox=None):
+        self.store = store
+        self.bbox = bbox
+        # The CRS of the .prj file, as cartopy's reader sets it
+        self.crs = None
+        if store.prj is not None:
+            import cartopy.crs as ccrs
+            from pyproj import CRS
+            self.crs = ccrs.Projection(CRS.from_wkt(store.prj))
+
+    def __len__(self):
+        return len(self.store)
+
+    def geometries(self):
+        return iter(self.store.geometries(bbox=self.bbox))
+
+    def records(self):
+        return iter(self.store.records(bbox=self.bbox))
+
+    def close(self):
+        pass
+
+
+def store_path(shapefile, store_dir=None):
+    """Return the path of the store of a shapefile."""
+    return keyed_path(shapefile, store_dir or DEFAULT_STORE_DIR, '.sqlite')
+
+
+# Stores opened in this process, by path
+_stores = {}
+
+
+def open_store(shapefile, store_dir=None):
+    """
+    Return the store of a shapefile, ingesting it first if it has no store,
+    or if it changed since it was ingested.
+    """
+    path = store_path(shapefile, store_dir)
+    store = _stores.get(path)
+    if store is None and os.path.exists(path):
+        store = GeometryStore(path)
+    if store is not None and os.path.exists(shapefile) and \
+            not source_matches(shapefile, store.source):
+        store.close()
+        store = None
+    if store is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        store = GeometryStore.ingest(shapefile, path)
+    _stores[path] = store
+    return store
+
+
+def _natural_earth_path(resolution, category, name):
+    """Return where cartopy keeps (or would download) a Natural Earth
+    shapefile, without downloading it."""
+    from cartopy import config
+    from cartopy.io import Downloader
+
+    downloader = Downloader.from_config(('shapefiles', 'natural_earth',
+                                         resolution, category, name))
+    format_dict = {'config': config, 'category': category, 'name': name,
+                   'resolution': resolution}
+    path = downloader.pre_downloaded_path(format_dict)
+    if path is not None and os.path.exists(path):
+        return path
+    return downloader.target_path(format_dict)
+
+
+def natural_earth_store(resolution='110m', category='physical',
+                        name='coastline', store_dir=None):
+    """Return the store of a Natural Earth shapefile (downloading the
+    shapefile only if it has no store yet)."""
+    from cartopy.io import shapereader
+
+    shapefile = _natural_earth_path(resolution, category, name)
+    if not os.path.exists(store_path(shapefile, store_dir)):
+        shapefile = shapereader.natural_earth(resolution, category, name)
+    return open_store(shapefile, store_dir)
+
+
+def install(store_dir=None):
+    """
+    Make cartopy read shapefiles from the geometry stores.
+
+    ``cartopy.io.shapereader.Reader(shapefile)`` returns a ``StoreReader``,
+    and ``natural_earth`` returns the path of a shapefile that has a store
+    without checking for (or downloading) the file.
+    """
+    from cartopy.io import shapereader
+
+    if getattr(shapereader.Reader, '_geometry_store', False):
+        return
+    Reader = shapereader.Reader
+    natural_earth = shapereader.natural_earth
+
+    def store_reader(filename, bbox=None, **kwargs):
+        if kwargs or not isinstance(filename, (str, os.PathLike)) or \
+                not (os.path.exists(filename) or
+                     os.path.exists(store_path(filename, store_dir))):
+            if bbox is not None:
+                kwargs['bbox'] = bbox
+            return Reader(filename, **kwargs)
+        return StoreReader(open_store(os.fspath(filename), store_dir), bbox)
+
+    def stored_natural_earth(resolution='110m', category='physical',
+                             name='coastline'):
+        shapefile = _natural_earth_path(resolution, category, name)
+        if os.path.exists(store_path(shapefile, store_dir)):
+            return shapefile
+        return natural_earth(resolution, category, name)
+
+    store_reader._geometry_store = True
+    store_reader.__wrapped__ = Reader
+    stored_natural_earth.__doc__ = natural_earth.__doc__
+    stored_natural_earth.__wrapped__ = natural_earth
+    shapereader.Reader = store_reader
+    shapereader.natural_earth = stored_natural_earth
@@ -0,0 +1,302 @@
+"""
+masking.py
+==========
+Masks of geographical regions on the grid of a dataset.
+
+Masking a field by a set of polygons (e.g. the countries of a shapefile)
+means testing every grid point against the polygons.  ``region_mask`` does
+it once per grid and set of geometries, in one vectorized call, and caches
+the mask on disk keyed by a hash of the grid coordinates and of the
+geometries: masking thousands of time steps, or rendering the same region
+again, reuses the mask instead of testing the polygons again.
+
+``region_coverage`` computes the fraction of the area of each grid cell
+within the region instead (exactly, from the intersections of the cells on
+the boundary with the region), cached in the same way.  Masking a field
+where the coverage is zero keeps every cell the region touches, so that
+filled contours reach the boundary, where a boolean mask of the grid points
+leaves blocky edges.
+
+``split_categories`` masks a field by each code of a category field (such as
+the land/ocean codes of ``ORO``), with a cyclic point, in one pass over the
+field for all the categories.
+
+Usage::
+
+    store = geostore.natural_earth_store('10m', 'cultural',
+                                         'admin_0_countries')
+    china_geoms = store.geometries(where={'ADMIN': 'China'})
+    china = region_mask(china_geoms, ds.lon, ds.lat)
+    T_china = ds.T.where(china)
+    T_edges = ds.T.where(region_coverage(china_geoms, ds.lon, ds.lat) > 0)
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+
+from gallery_tools.cyclic import add_cyclic
+from gallery_tools.fingerprint import array_digest, atomic_write
+from gallery_tools.runner import REPO_DIR
+
+# Directory of the cached masks (an empty string disables the disk cache)
+DEFAULT_CACHE_DIR = os.environ.get(
+    'GALLERY_MASK_DIR', os.path.join(REPO_DIR, '_build', 'mask_cache'))
+
+# Masks computed in this process, by key
+_masks = {}
+
+
+def mask_key(geometries, lon, lat, kind='mask'):
+    """Return the cache key of a mask of ``geometries`` on a grid."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(kind.encode())
+    array_digest(digest, np.asarray(lon, dtype=float))
+    array_digest(digest, np.asarray(lat, dtype=float))
+    for geom in geometries:
+        digest.update(geom.wkb)
+    return digest.hexdigest()
+
+
+def _wrap_longitudes(lon, geometries):
+    """Shift longitudes into the range of the geometries (-180 to 180 for
+    most shapefiles, while many grids go from 0 to 360)."""
+    if not geometries:
+        return lon
+    minx = min(geom.bounds[0] for geom in geometries)
+    return (lon - minx) % 360 + minx
+
+
+def contains(geometries, x, y):
+    """Return whether each point ``(x, y)`` is in one of the geometries
+    (points on a boundary are not)."""
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                               np.asarray(y, dtype=float))
+    inside = np.zeros(x.shape, dtype=bool)
+    try:
+        from shapely import contains_xy, prepare
+    except ImportError:
+        # shapely < 2: test against the matplotlib paths of the polygons
+        from cartopy.mpl.patch import geos_to_path
+
+        points = np.column_stack([x.ravel(), y.ravel()])
+        for path in geos_to_path(list(geometries)):
+            inside.ravel()[:] |= path.contains_points(points)
+        return inside
+    for geom in geometries:
+        prepare(geom)
+        xmin, ymin, xmax, ymax = geom.bounds
+        # Only test the points within the bounding box of the geometry
+        box = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax) & ~inside
+        inside[box] = contains_xy(geom, x[box], y[box])
+    return inside
+
+
+def _cached(key, compute, cache_dir):
+    """Return the mask ``key``, from memory, from disk or from ``compute``."""
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    if key in _masks:
+        return _masks[key]
+    fname = os.path.join(cache_dir, key + '.npy') if cache_dir else None
+    if fname and os.path.exists(fname):
+        mask = np.load(fname)
+    else:
+        mask = compute()
+        if fname:
+            os.makedirs(cache_dir, exist_ok=True)
+            with atomic_write(fname) as fid:
+                np.save(fid, mask)
+    mask.flags.writeable = False
+    _masks[key] = mask
+    return mask
+
+
+def _as_grid(values, lon, lat, name):
+    """Wrap a (lat, lon) array like the coordinates of the grid."""
+    lat_dim = lat.dims[0] if isinstance(lat, xr.DataArray) else 'lat'
+    lon_dim = lon.dims[0] if isinstance(lon, xr.DataArray) else 'lon'
+    return xr.DataArray(values, dims=(lat_dim, lon_dim), name=name,
+                        coords={lat_dim: np.asarray(lat),
+                                lon_dim: np.asarray(lon)})
+
+
+def region_mask(geometries, lon, lat, cache_dir=None):
+    """
+    Return the mask of the grid points within ``geometries``.
+
+    Parameters
+    ----------
+    geometries : iterable of shapely geometries
+        The region, in longitude/latitude coordinates.
+    lon, lat : 1-D array-like (e.g. the coordinates of a dataset)
+        The longitudes and latitudes of the grid.
+    cache_dir : str, optional
+        Directory of the cached masks (``DEFAULT_CACHE_DIR`` by default; an
+        empty string only caches masks in memory).
+
+    Returns
+    -------
+    xarray.DataArray
+        A boolean ``(lat, lon)`` mask, with the coordinates of the grid,
+        for ``var.where(mask)``.
+    """
+    geometries = [geom for geom in geometries
+                  if geom is not None and not geom.is_empty]
+    key = mask_key(geometries, lon, lat)
+
+    def compute():
+        x = _wrap_longitudes(np.asarray(lon, dtype=float), geometries)
+        y = np.asarray(lat, dtype=float)
+        return contains(geometries, x[np.newaxis, :], y[:, np.newaxis])
+
+    return _as_grid(_cached(key, compute, cache_dir), lon, lat, 'mask')
+
+
+def cell_edges(centers, limits=None):
+    """Return the edges of the cells around 1-D (sorted) cell centers,
+    half-way between the centers, clipped to ``limits``."""
+    centers = np.asarray(centers, dtype=float)
+    if centers.size == 1:
+        edges = centers + np.array([-0.5, 0.5])
+    else:
+        middle = (centers[1:] + centers[:-1]) / 2
+        edges = np.concatenate([[2 * centers[0] - middle[0]], middle,
+                                [2 * centers[-1] - middle[-1]]])
+    if limits is not None:
+        edges = np.clip(edges, *limits)
+    return edges
+
+
+def _coverage(geometries, x_edges, y_edges):
+    """Fraction of the area of each (y, x) cell within the geometries, for
+    the cell edges ``x_edges = (left, right)`` and ``y_edges``."""
+    from shapely.ops import unary_union
+
+    region = unary_union(geometries)
+    x0, y0 = np.meshgrid(np.minimum(*x_edges),
+                         np.minimum(y_edges[:-1], y_edges[1:]))
+    x1, y1 = np.meshgrid(np.maximum(*x_edges),
+                         np.maximum(y_edges[:-1], y_edges[1:]))
+    # Cells clear of the boundary are either inside or outside: their
+    # centres tell which
+    coverage = contains([region], (x0 + x1) / 2, (y0 + y1) / 2).astype(float)
+    try:
+        import shapely
+        from shapely.strtree import STRtree
+        cells = shapely.box(x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel())
+    except (ImportError, AttributeError):
+        # shapely < 2: intersect the cells with the region one at a time
+        from shapely.geometry import box
+        from shapely.prepared import prep
+
+        boundary = prep(region.boundary)
+        for index in np.ndindex(coverage.shape):
+            cell = box(x0[index], y0[index], x1[index], y1[index])
+            if cell.area > 0 and boundary.intersects(cell):
+                coverage[index] = region.intersection(cell).area / cell.area
+        return coverage
+    edge = np.unique(STRtree(cells).query(region.boundary,
+                                           predicate='intersects'))
+    edge = edge[shapely.area(cells[edge]) > 0]
+    shapely.prepare(region)
+    coverage.ravel()[edge] = shapely.area(
+        shapely.intersection(cells[edge], region)) / shapely.area(cells[edge])
+    return coverage
+
+
+def region_coverage(geometries, lon, lat, cache_dir=None):
+    """
+    Return the fraction of the area of each grid cell within
+    ``geometries``, between 0 and 1.
+
+    The cells are bounded half-way between the grid points (and at the
+    poles).  Fractions are areas in longitude/latitude coordinates, which
+    is exact enough within a cell.
+
+    Parameters
+    ----------
+    geometries : iterable of shapely geometries
+        The region, in longitude/latitude coordinates.
+    lon, lat : 1-D array-like (e.g. the coordinates of a dataset)
+        The longitudes and latitudes of the grid.
+    cache_dir : str, optional
+        Directory of the cached masks (``DEFAULT_CACHE_DIR`` by default; an
+        empty string only caches masks in memory).
+
+    Returns
+    -------
+    xarray.DataArray
+        The ``(lat, lon)`` coverage, with the coordinates of the grid.
+    """
+    geometries = [geom for geom in geometries
+                  if geom is not None and not geom.is_empty]
+    key = mask_key(geometries, lon, lat, kind='coverage')
+
+    def compute():
+        if not geometries:
+            return np.zeros((np.size(lat), np.size(lon)))
+        # Each cell is shifted by a multiple of 360 degrees that brings its
+        # centre into the range of the geometries
+        centers = np.asarray(lon, dtype=float)
+        shift = _wrap_longitudes(centers, geometries) - centers
+        x_edges = cell_edges(centers)
+        x_edges = (x_edges[:-1] + shift, x_edges[1:] + shift)
+        return _coverage(geometries, x_edges, cell_edges(lat, (-90, 90)))
+
+    return _as_grid(_cached(key, compute, cache_dir), lon, lat, 'coverage')
+
+
+def split_categories(var, codes, categories, cyclic=None):
+    """
+    Return ``var`` masked by each category of a code array (e.g. the land,
+    ocean and sea ice codes of ``ORO``), with ``cyclic`` points added.
+
+    ``var.where(codes == code)`` for each category compares the codes and
+    copies the field once per category, and adding a cyclic point copies
+    each masked field again.  Here the codes are matched against all the
+    categories at once, and the field is read in a single scatter that
+    fills every masked field; the cyclic column is added by
+    ``cyclic.add_cyclic``.
+
+    Parameters
+    ----------
+    var : xarray.DataArray
+        The field.
+    codes : xarray.DataArray
+        The codes, broadcastable against ``var``.
+    categories : dict
+        ``{name: code}``.
+    cyclic : str, optional
+        The (periodic, e.g. longitude) dimension of ``var`` to add a cyclic
+        point to.
+
+    Returns
+    -------
+    dict of xarray.DataArray
+        The masked fields, by category name (missing values are NaN).
+    """
+    names = list(categories)
+    category_codes = np.array([categories[name] for name in names])
+    order = np.argsort(category_codes, kind='stable')
+    sorted_codes = category_codes[order]
+    codes = codes.broadcast_like(var).transpose(*var.dims).values.ravel()
+    # The category of each point, in one pass over the codes
+    slots = np.searchsorted(sorted_codes, codes).clip(0, len(names) - 1)
+    points = np.flatnonzero(sorted_codes[slots] == codes)
+    values = var.values.ravel()
+    masked = np.full((len(names), values.size), np.nan,
+                     dtype=np.promote_types(values.dtype, np.float32))
+    masked[order[slots[points]], points] = values[points]
+
+    split = {}
+    for name, category in zip(names, masked):
+        split[name] = xr.DataArray(category.reshape(var.shape), dims=var.dims,
+                                   coords=var.coords, name=var.name,
+                                   attrs=var.attrs)
+        split[name].encoding = dict(var.encoding)
+        if cyclic is not None:
+            split[name] = add_cyclic(split[name], cyclic)
+    return split
@@ -0,0 +1,157 @@
+"""
+parallel.py
+===========
+A Sphinx extension that executes the gallery examples across a pool of
+worker processes.
+
+sphinx-gallery runs every stale example serially in the Sphinx process.  This
+extension runs first (it must be listed *before*
+``sphinx_gallery.gen_gallery`` in ``extensions``): it hands each stale example
+to a worker process, which generates the example's images, rst, notebook and
+md5 files with sphinx-gallery's own ``generate_file_rst``.  sphinx-gallery
+then finds every example up to date and only assembles the gallery index, in
+its usual deterministic order.  Examples that fail in a worker are left stale,
+so sphinx-gallery re-runs them and reports the error as usual.
+
+Set the number of workers with the ``gallery_jobs`` configuration value, e.g.
+``make html O="-D gallery_jobs=32"``.  ``gallery_jobs = 1`` (the default)
+leaves the build untouched.  Each worker caches the datasets opened by its
+examples (see ``gallery_tools.data``) within its share of
+``gallery_data_cache_mb`` megabytes, the budget of all the workers together
+(``conf.py`` sets 2048, ``GALLERY_DATA_CACHE_MB`` overrides it; 0 disables
+the cache, which is the default without a value), and opens ensembles of files,
+ASCII tables and shapefiles through the disk caches of
+``gallery_tools.ensemble``, ``gallery_tools.ascii_cache`` and
+``gallery_tools.geostore``.  It draws the map features within the map extent
+only (see ``gallery_tools.features``), and takes the contour lines of a field
+drawn with filled contours from the filled contours (see
+``gallery_tools.contour``).
+"""
+
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import sphinx_gallery
+from sphinx.util import logging
+from sphinx_gallery.gen_rst import executable_script, generate_file_rst
+
+from gallery_tools.examples import (_complete_gallery_conf, collect_examples,
+                                    complete_conf, is_current, is_supported)
+from gallery_tools.runner import warm_up
+
+logger = logging.getLogger(__name__)
+
+# Completed sphinx-gallery configuration of a worker process
+_worker_conf = None
+
+
+def _init_worker(sphinx_gallery_conf, src_dir, lang, builder_name,
+                 data_cache_mb):
+    """Give each worker process its own sphinx-gallery configuration (and
+    with it its own matplotlib state, set to the Agg backend), import the
+    plotting stack once for all the examples it will run and share the
+    datasets they open."""
+    from gallery_tools import (ascii_cache, contour, data, ensemble, features,
+                               geostore)
+
+    global _worker_conf
+    warm_up()
+    if data_cache_mb > 0:
+        data.install(data_cache_mb)
+    ensemble.install()
+    ascii_cache.install()
+    geostore.install()
+    features.install()
+    contour.install()
+    _worker_conf = _complete_gallery_conf(sphinx_gallery_conf, src_dir,
+                                          plot_gallery=True,
+                                          abort_on_example_error=False,
+                                          lang=lang,
+                                          builder_name=builder_name)
+
+
+def _run_example(src_dir, target_dir, fname):
+    """Execute one example in a worker and write its gallery output.
+
+    Returns ``(passed, time_elapsed, error)``.
+    """
+    gallery_conf = _worker_conf
+    gallery_conf['passing_examples'] = []
+    gallery_conf['failing_examples'] = {}
+    src_file = os.path.normpath(os.path.join(src_dir, fname))
+    try:
+        _, _, (time_elapsed, _) = generate_file_rst(fname, target_dir,
+                                                    src_dir, gallery_conf)
+    except Exception:
+        return False, 0., traceback.format_exc()
+    if src_file in gallery_conf['failing_examples']:
+        return False, time_elapsed, gallery_conf['failing_examples'][src_file]
+    return True, time_elapsed, None
+
+
+def run_examples_in_parallel(app):
+    """Execute the stale gallery examples in ``app.config.gallery_jobs``
+    worker processes."""
+    jobs = app.config.gallery_jobs
+    if jobs is None or int(jobs) <= 1:
+        return
+    gallery_conf = complete_conf(app)
+    if not gallery_conf['plot_gallery']:
+        return
+
+    src_dir = app.builder.srcdir
+    lang = app.builder.config.highlight_language
+    sphinx_gallery_conf = app.config.sphinx_gallery_conf
+
+    stale = [(example_dir, target_dir, fname)
+             for example_dir, target_dir, fname in collect_examples(gallery_conf)
+             if executable_script(os.path.join(example_dir, fname),
+                                  gallery_conf) and
+             not is_current(example_dir, target_dir, fname)]
+    if not stale:
+        return
+    for _, target_dir, _ in stale:
+        os.makedirs(target_dir, exist_ok=True)
+
+    jobs = min(int(jobs), len(stale))
+    logger.info('executing %d gallery examples in %d processes...'
+                % (len(stale), jobs), color='white')
+    t_start = time.time()
+    # 'spawn' gives every worker a fresh interpreter (no matplotlib or
+    # cartopy state inherited from the Sphinx process)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(sphinx_gallery_conf, src_dir, lang,
+                                       app.builder.name,
+                                       app.config.gallery_data_cache_mb /
+                                       jobs)
+                             ) as executor:
+        results = executor.map(_run_example, *zip(*stale))
+        # map() yields in submission order, so the report is deterministic
+        for (_, _, fname), (passed, time_elapsed, error) in zip(stale, results):
+            if passed:
+                logger.info('    - %s: %.2f sec' % (fname, time_elapsed))
+            else:
+                logger.info('    - %s: failed, deferred to sphinx-gallery'
+                            % fname)
+                logger.debug(error)
+    logger.info('parallel gallery execution: %.2f sec'
+                % (time.time() - t_start), color='white')
+
+
+def setup(app):
+    app.add_config_value('gallery_jobs', 1, '')
+    app.add_config_value('gallery_data_cache_mb', 0., '')
+    if not is_supported():
+        logger.warning('gallery_tools.parallel does not support '
+                       'sphinx-gallery %s: the examples run serially'
+                       % sphinx_gallery.__version__)
+        return {'parallel_read_safe': True, 'parallel_write_safe': True}
+    # Connected before sphinx_gallery.gen_gallery (see the extensions order
+    # in conf.py), so the examples are current when the gallery is generated
+    app.connect('builder-inited', run_examples_in_parallel)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
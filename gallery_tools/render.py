@@ -0,0 +1,171 @@
+"""
+render.py
+=========
+Render example scripts to image files without Sphinx.
+
+Every script runs in a persistent pool of warmed-up worker processes with
+matplotlib's Agg backend (see ``gallery_tools.runner``).  Each figure shown
+by a script is saved once per requested resolution and format, as
+``<output>/<directory>/<script>_<figure>_<dpi>dpi.<format>``, e.g.
+``XY/NCL_xy_18_001_150dpi.png``, where ``<directory>`` is the directory of
+the script relative to ``Plots/`` (or, for scripts outside ``Plots/``, to
+the directory all the scripts are in), so that scripts of the same name in
+different sections do not overwrite each other's images.  No rst, notebook
+or HTML is generated.
+
+The workers share the datasets the scripts open through
+``gallery_tools.data``, so a file read by several scripts is read and
+decoded once per worker, and open ensembles of files, ASCII tables and
+shapefiles through the disk caches of ``gallery_tools.ensemble``,
+``gallery_tools.ascii_cache`` and ``gallery_tools.geostore``.  Map features
+only draw their geometries within the map extent (see
+``gallery_tools.features``), and the contour lines of a field drawn with
+filled contours are taken from the filled contours (see
+``gallery_tools.contour``).
+
+Usage::
+
+    python -m gallery_tools.render -o products --dpi 100 300 --format png pdf
+    python -m gallery_tools.render 'Plots/Contours/*.py' Plots/XY/NCL_xy_18.py -j 8
+"""
+
+import argparse
+import os
+import sys
+import time
+import traceback
+
+from gallery_tools import (ascii_cache, contour, data, ensemble, features,
+                           geostore)
+from gallery_tools.runner import (EXAMPLES_DIR, REPO_DIR, find_scripts,
+                                  run_script, warm_pool)
+
+
+def render_script(path, output_dir, dpis=(100,), formats=('png',)):
+    """
+    Run a script and save the figures it shows in ``output_dir``.
+
+    Returns
+    -------
+    dict
+        ``files`` (the written images), ``time`` (seconds) and ``error``
+        (a traceback, or None).
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    files = []
+
+    def save_figures(figures):
+        for figure in figures:
+            index = len(files) // (len(dpis) * len(formats)) + 1
+            for dpi in dpis:
+                for fmt in formats:
+                    fname = os.path.join(output_dir, '%s_%03d_%ddpi.%s'
+                                         % (name, index, dpi, fmt))
+                    figure.savefig(fname, dpi=dpi, format=fmt)
+                    files.append(fname)
+
+    t_start = time.time()
+    error = None
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        run_script(path, on_show=save_figures)
+    except Exception:
+        error = traceback.format_exc()
+    return {'files': files, 'time': time.time() - t_start, 'error': error}
+
+
+def output_dirs(scripts, output_dir):
+    """
+    Return the directory of the images of each script: ``output_dir`` joined
+    with the directory of the script relative to ``Plots/``, or, if some
+    scripts are outside ``Plots/``, to the directory they all are in.
+    """
+    dirs = [os.path.dirname(os.path.abspath(script)) for script in scripts]
+    root = EXAMPLES_DIR
+    if any(os.path.relpath(path, root).startswith(os.pardir)
+           for path in dirs):
+        root = os.path.commonpath(dirs)
+    return [os.path.normpath(os.path.join(output_dir,
+                                          os.path.relpath(path, root)))
+            for path in dirs]
+
+
+def _init_caches(budget_mb):
+    if budget_mb > 0:
+        data.install(budget_mb)
+    ensemble.install()
+    ascii_cache.install()
+    geostore.install()
+    features.install()
+    contour.install()
+
+
+def render_scripts(scripts, output_dir, dpis=(100,), formats=('png',),
+                   jobs=None, data_cache_mb=data.DEFAULT_BUDGET_MB):
+    """
+    Render scripts in a pool of ``jobs`` worker processes.
+
+    The workers cache the datasets opened by the scripts within a memory
+    budget of ``data_cache_mb`` for all of them together, shared out equally
+    (0 disables the cache).
+
+    Workers import the plotting stack once and are reused from one script to
+    the next; each script still gets a fresh namespace and default matplotlib
+    settings.
+
+    Returns a list of ``(script, result)`` in the order of ``scripts``.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_dir = os.path.abspath(output_dir)
+    jobs = min(jobs or os.cpu_count(), len(scripts)) or 1
+    script_dirs = output_dirs(scripts, output_dir)
+    with warm_pool(jobs, _init_caches, (data_cache_mb / jobs,)) as executor:
+        futures = [executor.submit(render_script, script, script_dir,
+                                   tuple(dpis), tuple(formats))
+                   for script, script_dir in zip(scripts, script_dirs)]
+        return [(script, future.result())
+                for script, future in zip(scripts, futures)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m gallery_tools.render',
+        description='Render example scripts to image files without Sphinx.')
+    parser.add_argument('scripts', nargs='*',
+                        help='scripts or glob patterns (default: Plots/**/*.py)')
+    parser.add_argument('-o', '--output', default='rendered',
+                        help='output directory (default: rendered)')
+    parser.add_argument('-d', '--dpi', type=int, nargs='+', default=[100],
+                        help='resolutions to save each figure at (default: 100)')
+    parser.add_argument('-f', '--format', nargs='+', default=['png'],
+                        help='image formats, e.g. png pdf svg (default: png)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--data-cache-mb', type=float,
+                        default=data.DEFAULT_BUDGET_MB,
+                        help='memory budget of the dataset caches of all the '
+                             'workers together, 0 to disable '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    scripts = find_scripts(args.scripts)
+    t_start = time.time()
+    results = render_scripts(scripts, args.output, args.dpi, args.format,
+                             args.jobs, args.data_cache_mb)
+    failed = 0
+    for script, result in results:
+        name = os.path.relpath(script, REPO_DIR)
+        if result['error'] is None:
+            print('%-45s %3d files %8.2f s'
+                  % (name, len(result['files']), result['time']))
+        else:
+            failed += 1
+            print('%-45s FAILED\n%s' % (name, result['error']),
+                  file=sys.stderr)
+    print('rendered %d scripts in %.2f s (%d failed)'
+          % (len(results), time.time() - t_start, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+runner.py
+=========
+Execute an example script outside of Sphinx.
+
+The script runs as ``__main__`` in a fresh namespace, from its own directory
+(the examples open their data with paths such as ``../../data/...``), with
+matplotlib's Agg backend.  ``plt.show()`` is replaced by a hook that hands
+the open figures to a callback and closes them, which is what sphinx-gallery
+does with the figures of each code block.
+
+Long-lived workers can call ``warm_up`` once to pay the import and cache
+start-up cost of the plotting stack before running any script; see
+``warm_pool``.
+"""
+
+import builtins
+import glob
+import importlib
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+# Root of the repository and of the example scripts
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(REPO_DIR, 'Plots')
+
+# Modules imported by most examples, in import order
+WARM_MODULES = ('numpy', 'pandas', 'xarray', 'matplotlib.pyplot',
+                'matplotlib.ticker', 'cartopy.crs', 'cartopy.feature',
+                'cartopy.mpl.geoaxes', 'cartopy.mpl.ticker', 'cartopy.util',
+                'cartopy.io.shapereader', 'geocat.viz', 'geocat.viz.util',
+                'geocat.datafiles', 'cmaps')
+
+
+def find_scripts(patterns=None):
+    """
+    Expand file names and glob patterns into a sorted list of example scripts.
+
+    Parameters
+    ----------
+    patterns : list of str, optional
+        Script paths or (recursive) glob patterns.  Defaults to every script
+        under ``Plots/``.
+    """
+    if not patterns:
+        patterns = [os.path.join(EXAMPLES_DIR, '**', '*.py')]
+    scripts = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if not matches and not glob.has_magic(pattern):
+            raise FileNotFoundError(pattern)
+        scripts.update(os.path.abspath(match) for match in matches
+                       if match.endswith('.py'))
+    return sorted(scripts)
+
+
+@contextmanager
+def _in_script_dir(path):
+    """Run from the directory of the script, with the script as ``argv[0]``."""
+    cwd = os.getcwd()
+    argv = sys.argv[:]
+    script_dir = os.path.dirname(path)
+    os.chdir(script_dir)
+    sys.argv = [path]
+    sys.path.insert(0, script_dir)
+    try:
+        yield
+    finally:
+        sys.path.remove(script_dir)
+        sys.argv = argv
+        os.chdir(cwd)
+
+
+def reset_matplotlib():
+    """Close every figure and restore the default rcParams (as
+    sphinx-gallery's matplotlib resetter does between examples)."""
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    plt.close('all')
+    matplotlib.rcdefaults()
+
+
+def warm_up():
+    """
+    Import the plotting stack and fill its caches, once per process.
+
+    This imports ``WARM_MODULES`` (skipping the ones not installed), loads
+    matplotlib's font cache and default font, and builds the cartopy CRS
+    objects and GeoAxes machinery the examples use, so that the scripts run
+    afterwards in this process do not pay for them.
+    """
+    import matplotlib
+    matplotlib.use('agg')
+
+    for name in WARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    import matplotlib.pyplot as plt
+    from matplotlib import font_manager
+
+    font_manager.findfont(font_manager.FontProperties())
+    fig = plt.figure()
+    fig.text(0.5, 0.5, 'warm-up')
+    fig.canvas.draw()
+
+    try:
+        import cartopy.crs as ccrs
+    except ImportError:
+        pass
+    else:
+        # Projections are cached by cartopy/pyproj once created
+        for crs in (ccrs.PlateCarree(), ccrs.Mollweide(),
+                    ccrs.NorthPolarStereo(), ccrs.Robinson()):
+            crs.transform_point(0., 0., ccrs.PlateCarree())
+        ax = fig.add_subplot(projection=ccrs.PlateCarree())
+        ax.set_extent([100, 145, 15, 55], crs=ccrs.PlateCarree())
+        fig.canvas.draw()
+    reset_matplotlib()
+
+
+def _init_warm_worker(initializer, initargs):
+    warm_up()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def warm_pool(jobs=None, initializer=None, initargs=()):
+    """
+    Return a pool of ``jobs`` spawned worker processes that each run
+    ``warm_up`` (then ``initializer(*initargs)``, if given) when they start.
+
+    Scripts submitted with ``run_script`` (or a function calling it) then
+    only pay for their own work; each still runs in a fresh namespace with
+    every figure closed and default matplotlib settings.
+    """
+    context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=jobs or os.cpu_count(),
+                               mp_context=context,
+                               initializer=_init_warm_worker,
+                               initargs=(initializer, initargs))
+
+
+def run_script(path, on_show=None):
+    """
+    Execute an example script headlessly.
+
+    Parameters
+    ----------
+    path : str
+        The script to run.
+    on_show : callable, optional
+        Called as ``on_show(figures)`` with the list of open figures each
+        time the script calls ``plt.show()``, and once more at the end if
+        figures are left open.  The figures are closed afterwards.
+
+    Returns
+    -------
+    dict
+        The global namespace of the script after it ran.
+    """
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
+    path = os.path.abspath(path)
+    with open(path) as fid:
+        code = compile(fid.read(), path, 'exec')
+
+    def show(*args, **kwargs):
+        figures = [plt.figure(num) for num in plt.get_fignums()]
+        if figures and on_show is not None:
+            on_show(figures)
+        plt.close('all')
+
+    reset_matplotlib()
+    namespace = {'__name__': '__main__', '__file__': path,
+                 '__builtins__': builtins}
+    plt_show = plt.show
+    plt.show = show
+    try:
+        with _in_script_dir(path):
+            exec(code, namespace)
+            show()
+    finally:
+        plt.show = plt_show
+        reset_matplotlib()
+    return namespace
@@ -0,0 +1,266 @@
+"""
+stats.py
+========
+Reductions over large (ensemble) arrays that read their input one block at a
+time.
+
+The arrays may be in memory, lazily indexed from a file, or dask-backed; in
+every case, only a few blocks of the input are materialized at once, so the
+memory use does not grow with the length of the time or ensemble dimensions.
+The blocks are reduced in a pool of threads (numpy releases the GIL in the
+reductions).
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+# Default size of the blocks read from the input, in bytes
+DEFAULT_BLOCK_BYTES = 64 * 2 ** 20
+
+
+def _values(block):
+    """Return the values of a block as a numpy array, computing dask arrays
+    in the calling thread."""
+    data = block.data
+    if hasattr(data, 'compute'):
+        return np.asarray(data.compute(scheduler='synchronous'))
+    return np.asarray(block.values)
+
+
+def _split(shape, itemsize, block_bytes, ndim):
+    """Return the index tuples of the blocks of an array of ``shape``: runs
+    of rows along the first axis of about ``block_bytes``, or, when a row is
+    larger than that, each row split along the next of the first ``ndim``
+    axes."""
+    row_bytes = itemsize * int(np.prod(shape[1:]))
+    if row_bytes > block_bytes and ndim > 1:
+        inner = _split(shape[1:], itemsize, block_bytes, ndim - 1)
+        return [(slice(row, row + 1),) + key for row in range(shape[0])
+                for key in inner]
+    rows = max(block_bytes // max(row_bytes, 1), 1)
+    return [(slice(start, start + rows),) for start in range(0, shape[0], rows)]
+
+
+def _block_keys(var, block_bytes, ndim=1):
+    """Return the index tuples of the blocks of ``var`` of about
+    ``block_bytes``, split along its first ``ndim`` dimensions (at least one
+    element of those dimensions each)."""
+    if var.ndim == 0 or ndim == 0 or var.nbytes <= block_bytes:
+        return [()]
+    return _split(var.shape, var.dtype.itemsize, block_bytes,
+                  min(ndim, var.ndim))
+
+
+def _blocks(var, block_bytes, ndim=1):
+    """Split a DataArray along its first ``ndim`` dimensions into blocks of
+    about ``block_bytes`` (see ``_block_keys``)."""
+    return [var[key] for key in _block_keys(var, block_bytes, ndim)]
+
+
+def map_blocks(func, var, block_bytes=None, jobs=None, ndim=1):
+    """
+    Apply ``func`` to the values of each block of ``var`` (split along its
+    first ``ndim`` dimensions) in a thread pool, and return the list of
+    ``(key, result)`` pairs, ``key`` being the index of the block in
+    ``var``.
+
+    At most ``jobs`` blocks are materialized at a time.
+    """
+    keys = _block_keys(var, block_bytes or DEFAULT_BLOCK_BYTES, ndim)
+
+    def apply(key):
+        return key, func(_values(var[key]))
+
+    if len(keys) == 1:
+        return [apply(keys[0])]
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        return list(pool.map(apply, keys))
+
+
+def _assemble(parts, shape):
+    """Gather the ``(key, result)`` pairs of ``map_blocks`` of a reduction
+    that keeps the split dimensions into one array of ``shape``."""
+    if len(parts) == 1:
+        return parts[0][1]
+    values = np.empty(shape, dtype=np.result_type(*[part for _, part in
+                                                    parts]))
+    for key, part in parts:
+        values[key] = part
+    return values
+
+
+def _reduced_coords(var, dims):
+    return {name: coord for name, coord in var.coords.items()
+            if not set(coord.dims) & set(dims)}
+
+
+def weighted_spatial_mean(var, weights, lat='lat', lon='lon',
+                          block_bytes=None, jobs=None):
+    """
+    Weighted mean of ``var`` over latitude and longitude, with latitude
+    weights, as NCL computes it::
+
+        (var * weights).sum([lat, lon]) / (weights.sum(lat) * nlon)
+
+    Missing values count as zeros in the numerator, as in xarray's ``sum``.
+    The 1-D weights are applied to each block of ``var`` after summing over
+    longitude, so neither the weights broadcast to the grid nor the product
+    ``var * weights`` is ever formed.
+
+    Parameters
+    ----------
+    var : xarray.DataArray
+        The field, with ``lat`` and ``lon`` dimensions (and any others, e.g.
+        ``case`` and ``time``).
+    weights : xarray.DataArray
+        1-D latitude weights (e.g. Gaussian weights), aligned with ``var``
+        on the ``lat`` coordinate.
+    lat, lon : str
+        Names of the latitude and longitude dimensions.
+    block_bytes : int, optional
+        Size of the blocks of ``var`` read at a time
+        (``DEFAULT_BLOCK_BYTES`` by default).
+    jobs : int, optional
+        Number of threads (the CPU count by default).
+
+    Returns
+    -------
+    xarray.DataArray
+        The mean, over the other dimensions of ``var``, in memory.
+    """
+    var, weights = xr.align(var, weights, join='inner')
+    var = var.transpose(..., lat, lon)
+    w = np.asarray(weights.transpose(lat).values, dtype=float)
+    dtype = np.result_type(var.dtype, w.dtype)
+
+    def weighted_sum(values, w):
+        if values.dtype.kind in 'fc' and np.isnan(values).any():
+            values = np.where(np.isnan(values), 0, values)
+        return values.sum(axis=-1, dtype=dtype) @ w
+
+    if var.ndim > 2:
+        # Blocks split along the leading (e.g. case and time) dimensions, so
+        # that a block is at most one field however long the series
+        parts = map_blocks(lambda values: weighted_sum(values, w), var,
+                           block_bytes, jobs, ndim=var.ndim - 2)
+        total = _assemble(parts, var.shape[:-2])
+    else:
+        # A single field: blocks of latitudes, each with its weights
+        def block_sum(key):
+            return weighted_sum(_values(var[key]), w[key[0]] if key else w)
+
+        keys = _block_keys(var, block_bytes or DEFAULT_BLOCK_BYTES)
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            total = sum(pool.map(block_sum, keys))
+    mean = total / (w.sum() * var.sizes[lon])
+    return xr.DataArray(mean, dims=var.dims[:-2], name=var.name,
+                        coords=_reduced_coords(var, (lat, lon)))
+
+
+def _dask_stats(data, std, percentiles):
+    """The statistics of ``ensemble_stats`` of a dask array over its last
+    axis, computed in one ``dask.compute`` call."""
+    import dask
+    import dask.array as da
+
+    stats = {'min': da.nanmin(data, axis=-1), 'max': da.nanmax(data, axis=-1),
+             'mean': da.nanmean(data, axis=-1)}
+    if std:
+        stats['std'] = da.nanstd(data, axis=-1)
+    if percentiles is not None:
+        # The percentiles of each point need the whole ensemble in one chunk
+        data = data.rechunk({data.ndim - 1: -1})
+        stats['percentiles'] = data.map_blocks(
+            lambda values: np.moveaxis(np.nanpercentile(
+                values, percentiles, axis=-1), 0, -1),
+            chunks=data.chunks[:-1] + ((len(percentiles),),), dtype=float)
+    return dict(zip(stats, dask.compute(*stats.values())))
+
+
+def ensemble_stats(var, dim='case', std=False, percentiles=None,
+                   block_bytes=None, jobs=None):
+    """
+    Minimum, maximum and mean of ``var`` over ``dim`` (and optionally its
+    standard deviation and percentiles), in one traversal of ``var``.
+
+    Calling ``var.min(dim)``, ``var.max(dim)`` and ``var.mean(dim)`` reads
+    (and, for a dask-backed array, computes) ``var`` once per statistic.
+    Here each block of ``var`` is read once and every statistic is computed
+    from it while it is in memory.  For a dask-backed array, the statistics
+    are built as one dask graph and computed together instead, so that each
+    chunk of ``var`` (e.g. one ensemble member) is computed once whatever
+    its chunking.  Missing values are skipped, as in xarray's reductions.
+
+    Parameters
+    ----------
+    var : xarray.DataArray
+        The ensemble, in memory, lazily indexed or dask-backed.
+    dim : str
+        The ensemble dimension.
+    std : bool
+        Also compute the (population) standard deviation.
+    percentiles : sequence of float, optional
+        Also compute these percentiles (between 0 and 100).
+    block_bytes : int, optional
+        Size of the blocks of ``var`` read at a time
+        (``DEFAULT_BLOCK_BYTES`` by default).  Not used for a dask-backed
+        array, which is reduced along its own chunks.
+    jobs : int, optional
+        Number of threads (the CPU count by default).
+
+    Returns
+    -------
+    dict of xarray.DataArray
+        ``min``, ``max`` and ``mean``, plus ``std`` and ``percentiles``
+        (along a new ``percentile`` dimension) if requested.
+    """
+    # Blocks are split along another dimension than the ensemble one
+    var = var.transpose(..., dim)
+
+    def reduce(values):
+        stats = {}
+        if values.dtype.kind in 'fc' and np.isnan(values).any():
+            stats['min'] = np.nanmin(values, axis=-1)
+            stats['max'] = np.nanmax(values, axis=-1)
+            stats['mean'] = np.nanmean(values, axis=-1)
+            if std:
+                stats['std'] = np.nanstd(values, axis=-1)
+            if percentiles is not None:
+                stats['percentiles'] = np.nanpercentile(values, percentiles,
+                                                        axis=-1)
+        else:
+            stats['min'] = values.min(axis=-1)
+            stats['max'] = values.max(axis=-1)
+            stats['mean'] = values.mean(axis=-1)
+            if std:
+                stats['std'] = values.std(axis=-1)
+            if percentiles is not None:
+                stats['percentiles'] = np.percentile(values, percentiles,
+                                                     axis=-1)
+        if percentiles is not None:
+            stats['percentiles'] = np.moveaxis(stats['percentiles'], 0, -1)
+        return stats
+
+    if hasattr(var.data, 'dask'):
+        parts = [((), _dask_stats(var.data, std, percentiles))]
+    else:
+        # Blocks split along every dimension but the ensemble one (a 1-D
+        # ensemble is a single block)
+        parts = map_blocks(reduce, var, block_bytes, jobs, ndim=var.ndim - 1)
+    dims = var.dims[:-1]
+    coords = _reduced_coords(var, (dim,))
+    stats = {}
+    for name, first in parts[0][1].items():
+        values = _assemble([(key, part[name]) for key, part in parts],
+                           var.shape[:-1] + first.shape[var.ndim - 1:])
+        if name == 'percentiles':
+            stats[name] = xr.DataArray(
+                values, dims=dims + ('percentile',), name=var.name,
+                coords=dict(coords, percentile=list(percentiles)))
+        else:
+            stats[name] = xr.DataArray(values, dims=dims, coords=coords,
+                                       name=var.name)
+    return stats
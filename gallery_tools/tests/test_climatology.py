@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from gallery_tools import climatology
+
+
+def _series():
+    return xr.DataArray(np.arange(20.), dims='time', name='gavn',
+                        coords={'time': np.arange(1900, 1920)})
+
+
+def test_baseline_needs_key(tmp_path):
+    with pytest.raises(ValueError):
+        climatology.baseline(_series(), (1900, 1905), None,
+                             cache_dir=str(tmp_path))
+
+
+def test_baseline_keyed_by_key_and_sources(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    source = tmp_path / 'source.nc'
+    source.write_bytes(b'data')
+    var = _series()
+    assert float(climatology.baseline(var, (1900, 1905), 'series',
+                                      sources=[str(source)],
+                                      cache_dir=cache_dir)) == 2.5
+    climatology._baselines.clear()
+    # Same key and sources: the cached baseline
+    assert float(climatology.baseline(var + 1, (1900, 1905), 'series',
+                                      sources=[str(source)],
+                                      cache_dir=cache_dir)) == 2.5
+    # Another key, or changed sources: computed again
+    assert float(climatology.baseline(var + 1, (1900, 1905), 'shifted',
+                                      sources=[str(source)],
+                                      cache_dir=cache_dir)) == 3.5
+    source.write_bytes(b'new data')
+    assert float(climatology.baseline(var + 2, (1900, 1905), 'series',
+                                      sources=[str(source)],
+                                      cache_dir=cache_dir)) == 4.5
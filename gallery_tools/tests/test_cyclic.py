@@ -0,0 +1,62 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from gallery_tools import cyclic, masking
+
+
+def _field():
+    lon = np.arange(0., 360., 45.)
+    values = np.arange(3 * 4 * lon.size, dtype=float).reshape(3, 4, -1)
+    return xr.DataArray(values, dims=('time', 'lat', 'lon'),
+                        coords={'lon': ('lon', lon, {'units': 'degrees_east'})},
+                        name='TS', attrs={'units': 'K'})
+
+
+def test_add_cyclic():
+    var = _field()
+    var.encoding = {'dtype': 'float32'}
+    wrapped = cyclic.add_cyclic(var)
+    np.testing.assert_array_equal(wrapped[..., -1], var[..., 0])
+    np.testing.assert_array_equal(wrapped[..., :-1], var)
+    np.testing.assert_array_equal(wrapped.lon, np.arange(0., 361., 45.))
+    assert wrapped.lon.attrs == var.lon.attrs
+    assert wrapped.name == var.name and wrapped.attrs == var.attrs
+    assert wrapped.encoding == var.encoding
+
+
+def test_add_cyclic_dask_stays_lazy():
+    pytest.importorskip('dask')
+    var = _field().chunk({'time': 1})
+    wrapped = cyclic.add_cyclic(var)
+    assert hasattr(wrapped.data, 'dask')
+    np.testing.assert_array_equal(wrapped.isel(time=1, lon=-1),
+                                  var.isel(time=1, lon=0))
+
+
+def test_split_categories_cyclic():
+    var = _field()
+    codes = xr.DataArray(np.arange(var.lon.size) % 2, dims='lon')
+    split = masking.split_categories(var, codes, {'even': 0, 'odd': 1},
+                                     cyclic='lon')
+    wrapped = cyclic.add_cyclic(var)
+    wrapped_codes = cyclic.add_cyclic(codes)
+    for name, code in (('even', 0), ('odd', 1)):
+        xr.testing.assert_identical(split[name].lon, wrapped.lon)
+        np.testing.assert_array_equal(
+            split[name], wrapped.where(wrapped_codes == code))
+
+
+def test_add_cyclic_does_not_copy():
+    var = xr.DataArray(np.zeros((20, 50, 80)), dims=('time', 'lat', 'lon'))
+    tracemalloc.start()
+    try:
+        wrapped = cyclic.add_cyclic(var)
+        step = wrapped.isel(time=3).values
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert step.shape == (50, 81)
+    assert peak < var.nbytes / 4
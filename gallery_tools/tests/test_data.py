@@ -0,0 +1,40 @@
+import tracemalloc
+
+import numpy as np
+import xarray as xr
+
+from gallery_tools import data
+
+
+def _file(tmp_path):
+    path = str(tmp_path / 'field.nc')
+    xr.Dataset({'T': (('time', 'lon'), np.ones((200, 1000)))},
+               coords={'time': np.arange(200.)}).to_netcdf(path)
+    return path
+
+
+def test_cache_reads_only_selection(tmp_path):
+    path = _file(tmp_path)
+    cache = data.DatasetCache(2 ** 30, opener=xr.open_dataset)
+    tracemalloc.start()
+    try:
+        ds = cache.open_dataset(path)
+        step = ds.T.isel(time=0).values
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert step.shape == (1000,)
+    assert peak < ds.T.nbytes / 4
+    # Only the time index is held by the cache
+    assert cache.nbytes == ds.time.nbytes
+    cache.open_dataset(path).T.load()
+    assert cache.hits == 1 and cache.nbytes == ds.time.nbytes
+    cache.clear()
+
+
+def test_cache_evicts_over_budget(tmp_path):
+    path = _file(tmp_path)
+    cache = data.DatasetCache(100, opener=xr.open_dataset)
+    ds = cache.open_dataset(path)
+    assert cache.nbytes == 0
+    ds.close()
@@ -0,0 +1,31 @@
+import numpy as np
+import xarray as xr
+
+from gallery_tools import ensemble
+
+
+def _members(tmp_path, count=3):
+    paths = []
+    for index in range(count):
+        path = str(tmp_path / ('member%d.nc' % index))
+        xr.Dataset({'T': (('time', 'lat'), np.full((4, 3), float(index)))},
+                   coords={'time': np.arange(4) + 4 * index}).to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def test_install_keeps_xarray_defaults(tmp_path, monkeypatch):
+    monkeypatch.setattr(xr, 'open_mfdataset', xr.open_mfdataset)
+    paths = _members(tmp_path)
+    ensemble.install(cache_dir=str(tmp_path / 'cache'))
+    with xr.open_mfdataset(paths) as ds:
+        assert ds.sizes['time'] == 12
+
+
+def test_install_stacks_members(tmp_path, monkeypatch):
+    monkeypatch.setattr(xr, 'open_mfdataset', xr.open_mfdataset)
+    paths = _members(tmp_path)
+    ensemble.install(cache_dir=str(tmp_path / 'cache'))
+    ds = xr.open_mfdataset(paths, concat_dim='case', combine='nested',
+                           preprocess=lambda ds: ds.drop_vars('time'))
+    np.testing.assert_array_equal(ds.T.mean(['time', 'lat']), [0., 1., 2.])
@@ -0,0 +1,19 @@
+import numpy as np
+import xarray as xr
+
+from gallery_tools import masking
+
+
+def test_split_categories():
+    rng = np.random.default_rng(0)
+    var = xr.DataArray(rng.random((2, 5, 6)).astype(np.float32),
+                       dims=('lev', 'lat', 'lon'), name='TS')
+    codes = xr.DataArray(rng.integers(0, 4, (5, 6)).astype(float),
+                         dims=('lat', 'lon'))
+    codes[0, 0] = np.nan
+    categories = {'ocean': 0., 'land': 1., 'ice': 2.}
+    split = masking.split_categories(var, codes, categories)
+    assert list(split) == list(categories)
+    for name, code in categories.items():
+        assert split[name].dims == var.dims
+        xr.testing.assert_identical(split[name], var.where(codes == code))
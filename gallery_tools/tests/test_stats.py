@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from gallery_tools import stats
+
+
+@pytest.mark.parametrize('dims', [('lat', 'lon'), ('time', 'lat', 'lon'),
+                                  ('case', 'time', 'lat', 'lon')])
+@pytest.mark.parametrize('block_bytes', [1000, None])
+def test_weighted_spatial_mean(dims, block_bytes):
+    rng = np.random.default_rng(0)
+    sizes = {'case': 3, 'time': 7, 'lat': 50, 'lon': 40}
+    var = xr.DataArray(rng.random([sizes[dim] for dim in dims]), dims=dims)
+    var[..., 3, 5] = np.nan
+    weights = xr.DataArray(rng.random(sizes['lat']), dims='lat')
+    expected = (var * weights).sum(['lat', 'lon']) / (
+        weights.sum() * sizes['lon'])
+    mean = stats.weighted_spatial_mean(var, weights, block_bytes=block_bytes)
+    assert mean.dims == expected.dims
+    np.testing.assert_allclose(mean, expected)
+
+
+def _expected_stats(var, dim):
+    return {'min': var.min(dim), 'max': var.max(dim), 'mean': var.mean(dim),
+            'std': var.std(dim),
+            'percentiles': var.quantile([0.1, 0.9], dim).transpose(
+                ..., 'quantile')}
+
+
+def _check_stats(result, expected):
+    assert set(result) == set(expected)
+    for name in expected:
+        np.testing.assert_allclose(result[name], expected[name])
+
+
+def test_ensemble_stats_1d():
+    var = xr.DataArray(np.random.default_rng(0).random(50), dims='case')
+    result = stats.ensemble_stats(var, std=True, percentiles=[10, 90],
+                                  block_bytes=100)
+    _check_stats(result, _expected_stats(var, 'case'))
+
+
+def test_ensemble_stats_dask_computes_members_once():
+    dask = pytest.importorskip('dask')
+    da = pytest.importorskip('dask.array')
+    rng = np.random.default_rng(0)
+    members = [rng.random((12, 5, 4)) for _ in range(4)]
+    calls = []
+
+    def load(index):
+        calls.append(index)
+        return members[index]
+
+    var = xr.DataArray(
+        da.stack([da.from_delayed(dask.delayed(load)(index), (12, 5, 4),
+                                  float) for index in range(4)]),
+        dims=('case', 'time', 'lat', 'lon'))
+    result = stats.ensemble_stats(var, std=True, percentiles=[10, 90],
+                                  block_bytes=2000)
+    assert sorted(calls) == [0, 1, 2, 3]
+    _check_stats(result, _expected_stats(var.compute(), 'case'))
+
+
+@pytest.mark.parametrize('block_bytes', [100, 5000, 50000, 10 ** 9])
+def test_block_keys_bounded(block_bytes):
+    var = xr.DataArray(np.zeros((3, 7, 10, 12)),
+                       dims=('case', 'time', 'lat', 'lon'))
+    keys = stats._block_keys(var, block_bytes, ndim=2)
+    covered = np.zeros(var.shape[:2], dtype=int)
+    field_bytes = 10 * 12 * 8
+    for key in keys:
+        assert var[key].nbytes <= max(block_bytes, field_bytes)
+        covered[key[:2]] += 1
+    assert (covered == 1).all()
+
+
+def test_ensemble_stats_blocks():
+    var = xr.DataArray(np.random.default_rng(0).random((6, 5, 4)),
+                       dims=('time', 'lat', 'case'))
+    result = stats.ensemble_stats(var, std=True, percentiles=[10, 90],
+                                  block_bytes=40)
+    _check_stats(result, _expected_stats(var, 'case'))
@@ -0,0 +1,164 @@
+"""
+zarr_cache.py
+=============
+Convert netCDF files to chunked Zarr stores, and open the Zarr copy of a file
+instead of the file itself when it is up to date.
+
+Reading a netCDF file parses its header and decompresses whole variables (or
+whole netCDF chunks) on every run.  The Zarr copy is chunked for the way the
+examples read the data, one 2-D (lat, lon) slice per time step and level, so
+a selection only decompresses the slices it needs, and the chunks are read
+and decompressed in parallel.
+
+The variables are copied without CF decoding (``decode_cf=False``), so that
+the Zarr copy is decoded with whatever options the caller passes, exactly
+like the netCDF file would be.  Each store has a ``.json`` sidecar with the
+size, modification time and content hash of its source file; a store whose
+source changed is ignored (and rewritten by the next conversion).
+
+Usage::
+
+    python -m gallery_tools.zarr_cache              # files used by Plots/
+    python -m gallery_tools.zarr_cache data/netcdf_files/*.nc -o /scratch/zarr
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+
+import xarray as xr
+
+from gallery_tools.fingerprint import (atomic_write, keyed_path, source_info,
+                                       source_matches)
+from gallery_tools.runner import EXAMPLES_DIR, REPO_DIR
+
+# Directory of the Zarr stores
+DEFAULT_STORE_DIR = os.environ.get(
+    'GALLERY_ZARR_DIR', os.path.join(REPO_DIR, '_build', 'zarr_cache'))
+
+
+def store_path(path, store_dir=None):
+    """Return the path of the Zarr copy of a file."""
+    return keyed_path(path, store_dir or DEFAULT_STORE_DIR, '.zarr')
+
+
+def slice_chunks(variable):
+    """Chunk shape of one 2-D slice: 1 along the leading dimensions and the
+    full length of the last two."""
+    return tuple(1 if i < variable.ndim - 2 else size
+                 for i, size in enumerate(variable.shape))
+
+
+def convert(path, store_dir=None, overwrite=False):
+    """
+    Write the Zarr copy of a netCDF file, unless an up-to-date copy exists.
+
+    Returns the path of the store.
+    """
+    store = store_path(path, store_dir)
+    if not overwrite and find_store(path, store_dir) is not None:
+        return store
+    with xr.open_dataset(path, decode_cf=False) as ds:
+        for variable in ds.variables.values():
+            variable.encoding = {}
+        encoding = {name: {'chunks': slice_chunks(variable)}
+                    for name, variable in ds.data_vars.items()
+                    if variable.ndim > 0}
+        # The store is written under a temporary name and swapped in, then
+        # its sidecar, so that a crashed or concurrent conversion never
+        # leaves a partial store marked as up to date
+        with atomic_write(store, None) as tmp:
+            ds.to_zarr(tmp, mode='w', consolidated=True, encoding=encoding)
+    with atomic_write(store + '.json', 'w') as fid:
+        json.dump(source_info(path), fid, indent=1)
+    return store
+
+
+def find_store(path, store_dir=None):
+    """Return the path of the up-to-date Zarr copy of a file, or None."""
+    store = store_path(path, store_dir)
+    if not os.path.exists(store + '.json'):
+        return None
+    with open(store + '.json') as fid:
+        info = json.load(fid)
+    mtime_ns = info['mtime_ns']
+    if not source_matches(path, info):
+        return None
+    if info['mtime_ns'] != mtime_ns:
+        with atomic_write(store + '.json', 'w') as fid:
+            json.dump(info, fid, indent=1)
+    return store
+
+
+def open_dataset(path, store_dir=None, netcdf_opener=None, **kwargs):
+    """
+    Open a file like ``xarray.open_dataset``, from its Zarr copy if there is
+    an up-to-date one.
+
+    ``netcdf_opener`` (``xarray.open_dataset`` by default) opens the file
+    itself when there is no Zarr copy, or when an ``engine`` is requested.
+    """
+    if netcdf_opener is None:
+        netcdf_opener = xr.open_dataset
+    store = None
+    if kwargs.get('engine') is None:
+        store = find_store(path, store_dir)
+    if store is None:
+        return netcdf_opener(path, **kwargs)
+    kwargs.pop('engine', None)
+    kwargs.setdefault('chunks', None)
+    return xr.open_dataset(store, engine='zarr', consolidated=True, **kwargs)
+
+
+def example_files():
+    """Return the netCDF files opened by the example scripts (found in the
+    ``data`` submodule, or fetched with ``geocat.datafiles``)."""
+    names = set()
+    for script in glob.glob(os.path.join(EXAMPLES_DIR, '**', '*.py'),
+                            recursive=True):
+        with open(script) as fid:
+            names.update(re.findall(r'netcdf_files/[\w.\-]+\.nc', fid.read()))
+    files = []
+    for name in sorted(names):
+        path = os.path.join(REPO_DIR, 'data', name)
+        if not os.path.exists(path):
+            try:
+                import geocat.datafiles
+                path = geocat.datafiles.get(name)
+            except Exception:
+                print('%s not found' % name, file=sys.stderr)
+                continue
+        files.append(path)
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m gallery_tools.zarr_cache',
+        description='Convert netCDF files to chunked Zarr stores.')
+    parser.add_argument('files', nargs='*',
+                        help='netCDF files or glob patterns (default: the '
+                             'files opened by the example scripts)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='store directory (default: %s)'
+                             % DEFAULT_STORE_DIR)
+    parser.add_argument('--force', action='store_true',
+                        help='rewrite stores that are up to date')
+    args = parser.parse_args(argv)
+
+    if args.files:
+        files = sorted(set(match for pattern in args.files
+                           for match in glob.glob(pattern)))
+    else:
+        files = example_files()
+    for path in files:
+        store = convert(path, args.output, overwrite=args.force)
+        print('%s -> %s' % (path, store))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())